@@ -0,0 +1,193 @@
+"""Admission control for the prediction routes of a worker.
+
+At most `limit` requests run at once and at most `max_queue` more wait for
+a slot, in arrival order; anything beyond is rejected at once (503 with
+Retry-After) instead of joining a backlog that would only time out. A
+waiting request also gives up after `queue_timeout`.
+
+The limit adapts to the observed latency (AIMD): after every window of
+completed requests it grows by one if their p90 latency stayed under the
+target and the limit was actually reached, and shrinks by a quarter if
+the p90 went over the target.
+
+Admission runs before authentication, so a single user opening many
+connections could otherwise take every slot and queue place. No user
+(as named by the request, see the middleware) may hold more than
+ADMISSION_USER_SHARE of the slots and queue places at once; their
+requests beyond it are rejected while the others still get in.
+"""
+
+import asyncio
+import math
+import os
+import statistics
+import time
+from collections import deque
+
+from profiling import LATENCY_WINDOW, latency_summary
+
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", 32))
+ADMISSION_MIN_IN_FLIGHT = int(os.environ.get("ADMISSION_MIN_IN_FLIGHT", 2))
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", 64))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 2.0))
+ADMISSION_USER_SHARE = float(os.environ.get("ADMISSION_USER_SHARE", 0.25))
+ADMISSION_TARGET_LATENCY = (
+    float(os.environ.get("ADMISSION_TARGET_LATENCY_MS", 500)) / 1000
+)
+ADAPT_WINDOW = 50
+DECREASE_FACTOR = 0.75
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_in_flight=ADMISSION_MAX_IN_FLIGHT,
+        min_in_flight=ADMISSION_MIN_IN_FLIGHT,
+        max_queue=ADMISSION_MAX_QUEUE,
+        queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+        target_latency=ADMISSION_TARGET_LATENCY,
+        user_share=ADMISSION_USER_SHARE,
+    ):
+        self.max_in_flight = max_in_flight
+        self.min_in_flight = min(min_in_flight, max_in_flight)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.target_latency = target_latency
+        self.user_share = user_share
+        self.limit = max_in_flight
+        self.in_flight = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.over_share = 0
+        self.increases = 0
+        self.decreases = 0
+        self._waiters = deque()
+        self._per_user = {}  # user -> requests admitted or waiting
+        self._window = []
+        self._saturated = False
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._queue_waits = deque(maxlen=LATENCY_WINDOW)
+
+    def user_limit(self):
+        return max(1, math.ceil(self.user_share * (self.limit + self.max_queue)))
+
+    def has_share(self, user):
+        # False if the user already holds their share of slots and queue places
+        if self._per_user.get(user, 0) < self.user_limit():
+            return True
+        self.over_share += 1
+        return False
+
+    async def acquire(self, user=None):
+        # True once the request holds a slot, False if it must be rejected;
+        # every True is followed by release(latency, user)
+        if self.in_flight < self.limit and not self._waiters:
+            self._enter(user)
+            self._admit()
+            return True
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            return False
+
+        self.queued += 1
+        self._enter(user)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not waiter.done():
+                waiter.cancel()
+                self._waiters.remove(waiter)
+                self._leave(user)
+                self.timed_out += 1
+                return False
+        except asyncio.CancelledError:
+            # the client went away: give back a slot handed over meanwhile
+            if waiter.done():
+                self.release(None, user)
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+                self._leave(user)
+            raise
+        self._queue_waits.append(time.perf_counter() - start)
+        return True
+
+    def _admit(self):
+        self.in_flight += 1
+        self.admitted += 1
+        if self.in_flight >= self.limit:
+            self._saturated = True
+
+    def _enter(self, user):
+        self._per_user[user] = self._per_user.get(user, 0) + 1
+
+    def _leave(self, user):
+        count = self._per_user.pop(user) - 1
+        if count:
+            self._per_user[user] = count
+
+    def release(self, latency, user=None):
+        # latency of the finished request in seconds (None if it never ran)
+        self.in_flight -= 1
+        self._leave(user)
+        if latency is not None:
+            self._latencies.append(latency)
+            self._window.append(latency)
+            if len(self._window) >= ADAPT_WINDOW:
+                self._adapt()
+        self._wake()
+
+    def _adapt(self):
+        p90 = statistics.quantiles(self._window, n=10)[8]
+        if p90 > self.target_latency and self.limit > self.min_in_flight:
+            self.limit = max(self.min_in_flight, int(self.limit * DECREASE_FACTOR))
+            self.decreases += 1
+        elif (
+            p90 <= self.target_latency
+            and self._saturated
+            and self.limit < self.max_in_flight
+        ):
+            self.limit += 1
+            self.increases += 1
+        self._window = []
+        self._saturated = self.in_flight >= self.limit
+
+    def _wake(self):
+        # hand free slots to the oldest waiters
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._admit()
+                waiter.set_result(None)
+
+    def retry_after(self):
+        # seconds until the queue ahead has likely drained, at least 1
+        latency = statistics.median(self._latencies) if self._latencies else 1.0
+        waves = (len(self._waiters) + self.limit) / max(self.limit, 1)
+        return max(1, math.ceil(latency * waves))
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queue": len(self._waiters),
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "target_latency_ms": self.target_latency * 1000,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "user_limit": self.user_limit(),
+            "over_share": self.over_share,
+            "users": dict(self._per_user),
+            "limit_increases": self.increases,
+            "limit_decreases": self.decreases,
+            "latency_ms": latency_summary(list(self._latencies)),
+            "queue_wait_ms": latency_summary(list(self._queue_waits)),
+        }
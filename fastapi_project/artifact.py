@@ -0,0 +1,185 @@
+"""Safe, memory-mapped model artifact (instead of a pickle).
+
+A fitted TfidfVectorizer + MultinomialNB pipeline is exported as raw NumPy
+arrays (vocabulary, IDF weights, NB parameters) and a JSON manifest holding
+the vectorizer settings, a format version and the SHA-256 of every file.
+Loading never unpickles anything: arrays are memory-mapped and inference is
+done by CompactModel with the same maths as the sklearn pipeline.
+"""
+
+import hashlib
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+from scipy.special import logsumexp
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
+
+FORMAT = "tfidf-multinomialnb"
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+
+# a downcast model must agree with the float64 one within these bounds
+MIN_LABEL_AGREEMENT = 0.999
+MAX_PROBA_DIFFERENCE = 1e-3
+
+VECTORIZER_SETTINGS = (
+    "lowercase",
+    "strip_accents",
+    "token_pattern",
+    "ngram_range",
+    "stop_words",
+    "binary",
+    "norm",
+    "use_idf",
+    "smooth_idf",
+    "sublinear_tf",
+)
+
+
+def sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def export_model(pipeline, out_dir, dtype="float64"):
+    # dtype="float32" halves the parameter arrays; scoring then runs in float32
+    dtype = np.dtype(dtype)
+    vectorizer = pipeline.named_steps["tfidf"]
+    classifier = pipeline.named_steps["classifier"]
+    if vectorizer.analyzer != "word" or vectorizer.tokenizer or vectorizer.preprocessor:
+        raise ValueError("only the default word analyzer can be exported")
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # terms in feature index order, as a UTF-8 buffer plus offsets
+    terms = [term.encode() for term in vectorizer.get_feature_names_out()]
+    with open(out_dir / "vocabulary.data", "wb") as f:
+        f.write(b"".join(terms))
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum([len(term) for term in terms], out=offsets[1:])
+    if offsets[-1] <= np.iinfo(np.uint32).max:
+        offsets = offsets.astype(np.uint32)
+
+    arrays = {
+        "vocabulary.offsets": offsets,
+        "idf": vectorizer.idf_.astype(dtype),
+        "feature_log_prob": classifier.feature_log_prob_.astype(dtype),
+        "class_log_prior": classifier.class_log_prior_.astype(dtype),
+        "classes": classifier.classes_,
+    }
+    for name, array in arrays.items():
+        np.save(
+            out_dir / f"{name}.npy", np.ascontiguousarray(array), allow_pickle=False
+        )
+
+    settings = {key: getattr(vectorizer, key) for key in VECTORIZER_SETTINGS}
+    if isinstance(settings["stop_words"], (set, frozenset)):
+        settings["stop_words"] = sorted(settings["stop_words"])
+    files = ["vocabulary.data"] + [f"{name}.npy" for name in arrays]
+    manifest = {
+        "format": FORMAT,
+        "version": FORMAT_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "features": len(terms),
+        "dtype": dtype.name,
+        "vectorizer": settings,
+        "files": {name: sha256(out_dir / name) for name in files},
+    }
+    with open(out_dir / MANIFEST, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+class CompactModel:
+    """predict / predict_proba on raw texts, from the exported arrays."""
+
+    def __init__(self, manifest, arrays, terms):
+        settings = dict(manifest["vectorizer"])
+        self.manifest = manifest
+        self.norm = settings.pop("norm")
+        self.use_idf = settings.pop("use_idf")
+        self.sublinear_tf = settings.pop("sublinear_tf")
+        settings.pop("smooth_idf")
+        settings["ngram_range"] = tuple(settings["ngram_range"])
+        # the count matrix has int32 indices unless it is too large for them
+        self.vectorizer = CountVectorizer(
+            vocabulary={term: i for i, term in enumerate(terms)},
+            dtype=np.dtype(manifest.get("dtype", "float64")),
+            **settings,
+        )
+        self.idf = arrays["idf"]
+        self.feature_log_prob = arrays["feature_log_prob"]
+        self.class_log_prior = arrays["class_log_prior"]
+        self.classes_ = np.asarray(arrays["classes"])
+
+    def transform(self, texts):
+        # same steps as TfidfTransformer.transform
+        X = self.vectorizer.transform(texts)
+        if self.sublinear_tf:
+            np.log(X.data, X.data)
+            X.data += 1
+        if self.use_idf:
+            X.data *= self.idf[X.indices]
+        if self.norm:
+            X = normalize(X, norm=self.norm, copy=False)
+        return X
+
+    def joint_log_likelihood(self, texts):
+        return self.transform(texts) @ self.feature_log_prob.T + self.class_log_prior
+
+    def predict_proba(self, texts):
+        jll = self.joint_log_likelihood(texts)
+        return np.exp(jll - logsumexp(jll, axis=1, keepdims=True))
+
+    def predict(self, texts):
+        return self.classes_[self.joint_log_likelihood(texts).argmax(axis=1)]
+
+
+def compare_models(reference, candidate, texts):
+    # agreement of a candidate model (e.g. float32) with a reference model
+    reference_proba = reference.predict_proba(texts)
+    candidate_proba = candidate.predict_proba(texts)
+    agreement = float(
+        (reference_proba.argmax(axis=1) == candidate_proba.argmax(axis=1)).mean()
+    )
+    difference = float(np.abs(reference_proba - candidate_proba).max())
+    return {
+        "reviews": len(texts),
+        "label_agreement": agreement,
+        "max_proba_difference": difference,
+        "ok": agreement >= MIN_LABEL_AGREEMENT and difference <= MAX_PROBA_DIFFERENCE,
+    }
+
+
+def load_model(path, verify=True):
+    path = Path(path)
+    with open(path / MANIFEST) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT or manifest.get("version") != FORMAT_VERSION:
+        raise ValueError(
+            "unsupported model artifact {}/{}".format(
+                manifest.get("format"), manifest.get("version")
+            )
+        )
+    if verify:
+        for name, checksum in manifest["files"].items():
+            if sha256(path / name) != checksum:
+                raise ValueError(f"checksum mismatch for {path / name}")
+
+    arrays = {
+        name[: -len(".npy")]: np.load(path / name, mmap_mode="r", allow_pickle=False)
+        for name in manifest["files"]
+        if name.endswith(".npy")
+    }
+    with open(path / "vocabulary.data", "rb") as f:
+        data = f.read()
+    offsets = arrays.pop("vocabulary.offsets").tolist()
+    terms = [data[start:end].decode() for start, end in zip(offsets[:-1], offsets[1:])]
+    return CompactModel(manifest, arrays, terms)
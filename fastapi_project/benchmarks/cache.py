@@ -0,0 +1,99 @@
+"""Shared prediction cache lookups vs model calls, on new-cashnet.csv.
+
+Run from fastapi_project/: python -m benchmarks.cache [model.pkl] [CSV] [processes]
+Fills a fresh cache with the predictions of every review, then each process
+(standing in for a uvicorn worker) looks reviews up one at a time while one
+of them keeps writing, and the lookup latency is compared with the latency
+of a single-review model call.
+"""
+
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import joblib
+
+from cache import PredictionCache
+from dataset import read_dataset
+from preprocessing import clean_batch
+
+VERSION = "benchmark"
+LOOKUPS = 5000
+
+
+def percentiles(timings):
+    cuts = statistics.quantiles(timings, n=100)
+    return cuts[49] * 1e6, cuts[98] * 1e6
+
+
+def reader(path, texts, writer, results):
+    cache = PredictionCache(path)
+    timings = []
+    for i in range(LOOKUPS):
+        text = texts[(i * 7919) % len(texts)]
+        start = time.perf_counter()
+        cache.get_many(VERSION, [text])
+        timings.append(time.perf_counter() - start)
+        if writer and i % 10 == 0:
+            cache.put_many(VERSION, [text], [0.5])
+    results.put((cache.hits, cache.misses, cache.errors, timings))
+
+
+def main(pickle_path="model.pkl", data_path="new-cashnet.csv", processes=None):
+    processes = int(processes or os.cpu_count())
+    model = joblib.load(pickle_path)
+    texts = clean_batch(
+        read_dataset(data_path, columns=["reviews"])["reviews"]
+    ).tolist()
+
+    model_timings = []
+    for text in texts[:1000]:
+        start = time.perf_counter()
+        model.predict_proba([text])
+        model_timings.append(time.perf_counter() - start)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cache.sqlite")
+        cache = PredictionCache(path)
+        start = time.perf_counter()
+        cache.put_many(VERSION, texts, model.predict_proba(texts)[:, 1].tolist())
+        print(
+            "filled {} reviews in {:.0f} ms".format(
+                len(texts), (time.perf_counter() - start) * 1000
+            )
+        )
+
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(target=reader, args=(path, texts, i == 0, results))
+            for i in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        runs = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+
+    hits = sum(run[0] for run in runs)
+    lookups = sum(run[0] + run[1] for run in runs)
+    errors = sum(run[2] for run in runs)
+    timings = [t for run in runs for t in run[3]]
+    print("{:<28}{:>10}{:>10}".format("", "p50 us", "p99 us"))
+    print(
+        "{:<28}{:>10.1f}{:>10.1f}".format(
+            "model call (1 review)", *percentiles(model_timings)
+        )
+    )
+    print(
+        "{:<28}{:>10.1f}{:>10.1f}".format(
+            f"cache lookup ({processes} procs)", *percentiles(timings)
+        )
+    )
+    print("hit rate {:.4f}, errors {}".format(hits / lookups, errors))
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
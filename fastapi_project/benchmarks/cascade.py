@@ -0,0 +1,77 @@
+"""Lexicon cascade in front of the model, on new-cashnet.csv.
+
+Run from fastapi_project/: python -m benchmarks.cascade [model.pkl] [CSV]
+For each threshold: the fraction of reviews the lexicon answers alone, the
+accuracy of cascade and model against the labels, their agreement, and the
+mean time per review scored one at a time (as POST /sentiments-prediction).
+"""
+
+import sys
+import time
+
+import joblib
+import numpy as np
+
+from cascade import Lexicon
+from dataset import read_dataset
+from preprocessing import clean_batch
+
+THRESHOLDS = (0.8, 0.9, 0.95, 0.99, 0.999)
+
+
+def per_review_seconds(score, texts, n=2000):
+    start = time.perf_counter()
+    for text in texts[:n]:
+        score(text)
+    return (time.perf_counter() - start) / min(n, len(texts))
+
+
+def main(pickle_path="model.pkl", data_path="new-cashnet.csv"):
+    model = joblib.load(pickle_path)
+    dataset = read_dataset(data_path, columns=["reviews", "sentiment"])
+    texts = clean_batch(dataset["reviews"]).tolist()
+    labels = dataset["sentiment"].to_numpy()
+
+    model_positive = model.predict_proba(texts)[:, 1]
+    model_labels = (model_positive > 0.5).astype(labels.dtype)
+    model_seconds = per_review_seconds(lambda text: model.predict_proba([text]), texts)
+    print(
+        "model: accuracy {:.4f}, {:.0f} us/review".format(
+            (model_labels == labels).mean(), model_seconds * 1e6
+        )
+    )
+
+    print(
+        "{:>10}{:>16}{:>12}{:>12}{:>12}".format(
+            "threshold", "short-circuit", "accuracy", "agreement", "us/review"
+        )
+    )
+    for threshold in THRESHOLDS:
+        lexicon = Lexicon(model, threshold)
+        answers = [lexicon.score(text) for text in texts]
+        answered = np.array([answer is not None for answer in answers])
+        positive = np.where(
+            answered,
+            [0.0 if answer is None else answer for answer in answers],
+            model_positive,
+        )
+        cascade_labels = (positive > 0.5).astype(labels.dtype)
+
+        def score(text):
+            if lexicon.score(text) is None:
+                model.predict_proba([text])
+
+        print(
+            "{:>10}{:>16.3f}{:>12.4f}{:>12.4f}{:>12.0f}".format(
+                threshold,
+                answered.mean(),
+                (cascade_labels == labels).mean(),
+                (cascade_labels == model_labels).mean(),
+                per_review_seconds(score, texts) * 1e6,
+            )
+        )
+    print("exact lexicon (unigram model):", lexicon.exact)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
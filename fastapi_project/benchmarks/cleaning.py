@@ -0,0 +1,36 @@
+"""Scalar vs batch text cleaning on new-cashnet.csv.
+
+Run from fastapi_project/: python -m benchmarks.cleaning [CSV or columnar dir]
+Exits with an error if the two cleaners disagree on any review.
+"""
+
+import sys
+import timeit
+
+from dataset import read_dataset
+from preprocessing import clean_batch, lemmatizer, text_cleaning
+
+
+def main(path="new-cashnet.csv", repeat=5):
+    reviews = read_dataset(path, columns=["reviews"])["reviews"].fillna("")
+    # warm the lemma memo so both sides pay the same WordNet cost
+    lemmatizer.build(clean_batch(reviews, lemmatize_words=False))
+
+    scalar = reviews.apply(text_cleaning)
+    batch = clean_batch(reviews)
+    scalar_time = min(
+        timeit.repeat(lambda: reviews.apply(text_cleaning), number=1, repeat=repeat)
+    )
+    batch_time = min(
+        timeit.repeat(lambda: clean_batch(reviews), number=1, repeat=repeat)
+    )
+
+    mismatches = (scalar != batch).sum()
+    print("{} reviews, {} mismatches".format(len(reviews), mismatches))
+    print("scalar: {:8.0f} reviews/s".format(len(reviews) / scalar_time))
+    print("batch:  {:8.0f} reviews/s".format(len(reviews) / batch_time))
+    return mismatches == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main(*sys.argv[1:]) else 1)
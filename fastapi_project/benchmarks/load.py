@@ -0,0 +1,164 @@
+"""Load harness for the prediction API.
+
+Start the server first, without the per-user token buckets unless they are
+what is measured (USER_RATE_LIMIT=0 python main.py), then from
+fastapi_project/:
+
+    python -m benchmarks.load --requests 500 --concurrency 16 --batch-size 100
+
+Each scenario posts batches of reviews from new-cashnet.csv, spread over the
+--users in turn, and reports latency percentiles of the accepted requests,
+throughput and the response bytes read off the wire. Rejections are counted
+apart: admission control sheds with 503, or 429 beyond a user's share of
+its slots ("429 adm"), the rate limiter answers 429 once a user's bucket is
+empty ("429 rate"). GET /admission adds the queue wait and in-flight limit
+when the admin credentials are valid.
+"""
+
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import requests
+
+SCENARIOS = {
+    # name: (reuse connections, Accept-Encoding)
+    "new connection, identity": (False, "identity"),
+    "keep-alive, identity": (True, "identity"),
+    "keep-alive, gzip": (True, "gzip"),
+    "keep-alive, br": (True, "br"),
+}
+ROW = (
+    "{:<28}{ok:>6}{shed:>6}{over_share:>9}{rate_limited:>10}"
+    "{req/s:>9.1f}{p50 ms:>9.1f}{p99 ms:>9.1f}{KiB/resp:>10.1f}"
+)
+# detail of the rate limiter's 429 (main.py); admission's 429 says otherwise
+RATE_LIMITED = "Rate limit exceeded"
+
+
+def load_batches(path, batch_size, count):
+    reviews = pd.read_csv(path, usecols=["reviews"])["reviews"].dropna().tolist()
+    return [
+        reviews[(i * batch_size) % len(reviews) :][:batch_size] for i in range(count)
+    ]
+
+
+def run_scenario(args, batches, keep_alive, encoding):
+    local = threading.local()
+
+    def session():
+        if not keep_alive:
+            return requests
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session
+
+    def post(numbered):
+        i, batch = numbered
+        t0 = time.perf_counter()
+        response = session().post(
+            args.url + "/sentiments-prediction/batch",
+            json={"reviews": batch},
+            auth=args.users[i % len(args.users)],
+            headers={
+                "Accept-Encoding": encoding,
+                "Connection": "keep-alive" if keep_alive else "close",
+            },
+        )
+        latency = time.perf_counter() - t0
+        # bytes of the body as received, before requests decodes it
+        size = response.raw.tell()
+        code = response.status_code
+        if code == 429 and response.json().get("detail") == RATE_LIMITED:
+            code = "429 rate"
+        elif code == 429:
+            code = "429 adm"
+        return code, latency, size
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        results = list(pool.map(post, enumerate(batches)))
+    elapsed = time.perf_counter() - t0
+
+    # shed requests answer in a few ms: keep them out of the percentiles
+    latencies = sorted(latency for code, latency, _ in results if code == 200) or [
+        0.0,
+        0.0,
+    ]
+    quantiles = (
+        statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    )
+    return {
+        "ok": sum(1 for code, _, _ in results if code == 200),
+        "shed": sum(1 for code, _, _ in results if code == 503),
+        "over_share": sum(1 for code, _, _ in results if code == "429 adm"),
+        "rate_limited": sum(1 for code, _, _ in results if code == "429 rate"),
+        "req/s": len(results) / elapsed,
+        "p50 ms": quantiles[49] * 1000,
+        "p99 ms": quantiles[98] * 1000,
+        "KiB/resp": statistics.mean(size for _, _, size in results) / 1024,
+    }
+
+
+def admission_stats(args):
+    response = requests.get(
+        args.url + "/admission", auth=(args.admin_user, args.admin_password)
+    )
+    return response.json() if response.status_code == 200 else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--data", default="new-cashnet.csv")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument(
+        "--users",
+        default="ali:AZ12345,dan:DA12345,andre:AN12345",
+        help="comma-separated user:password pairs, used in turn",
+    )
+    parser.add_argument("--admin-user", default="admin")
+    parser.add_argument("--admin-password", default="ADMIN12345")
+    args = parser.parse_args()
+    args.users = [tuple(pair.split(":", 1)) for pair in args.users.split(",")]
+
+    batches = load_batches(args.data, args.batch_size, args.requests)
+    print(
+        "{:<28}{:>6}{:>6}{:>9}{:>10}{:>9}{:>9}{:>9}{:>10}".format(
+            "scenario",
+            "ok",
+            "503",
+            "429 adm",
+            "429 rate",
+            "req/s",
+            "p50 ms",
+            "p99 ms",
+            "KiB/resp",
+        )
+    )
+    for name, (keep_alive, encoding) in SCENARIOS.items():
+        before = admission_stats(args)
+        stats = run_scenario(args, batches, keep_alive, encoding)
+        print(ROW.format(name, **stats))
+        after = admission_stats(args)
+        if before and after:
+            print(
+                "{:<28}rejected {}, over share {}, timed out {}, queue wait {}, "
+                "limit {}".format(
+                    "  admission",
+                    after["rejected"] - before["rejected"],
+                    after["over_share"] - before["over_share"],
+                    after["timed_out"] - before["timed_out"],
+                    after["queue_wait_ms"],
+                    after["limit"],
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
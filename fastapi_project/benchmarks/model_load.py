@@ -0,0 +1,57 @@
+"""Model load time and memory: joblib pickle vs the memory-mapped artifact.
+
+Run from fastapi_project/:
+    python -m benchmarks.model_load data/modele.pkl data/model
+
+Each load runs in a fresh interpreter; memory is the RSS growth of the load.
+"""
+
+import json
+import subprocess
+import sys
+
+LOADERS = {
+    "joblib.load": "import joblib; model = joblib.load({path!r})",
+    "artifact (verified)": (
+        "from artifact import load_model; model = load_model({path!r})"
+    ),
+    "artifact (no checksum)": (
+        "from artifact import load_model; model = load_model({path!r}, verify=False)"
+    ),
+}
+
+SNIPPET = """
+import json, time
+# modules the serving app imports anyway
+import numpy, pandas, scipy.special
+import sklearn.feature_extraction.text, sklearn.naive_bayes, sklearn.pipeline
+import sklearn.preprocessing
+from profiling import current_rss
+rss, t0 = current_rss(), time.perf_counter()
+{load}
+model.predict_proba(["warm up"])
+seconds, rss_mb = time.perf_counter() - t0, (current_rss() - rss) / 2**20
+print(json.dumps({{"seconds": seconds, "rss_mb": rss_mb}}))
+"""
+
+
+def measure(load, repeat=5):
+    runs = [
+        json.loads(
+            subprocess.check_output([sys.executable, "-c", SNIPPET.format(load=load)])
+        )
+        for _ in range(repeat)
+    ]
+    return min(r["seconds"] for r in runs), min(r["rss_mb"] for r in runs)
+
+
+def main(pickle_path="model.pkl", artifact_path="model"):
+    print("{:<24}{:>12}{:>12}".format("loader", "load ms", "RSS MB"))
+    for name, load in LOADERS.items():
+        path = pickle_path if name.startswith("joblib") else artifact_path
+        seconds, rss_mb = measure(load.format(path=path))
+        print("{:<24}{:>12.1f}{:>12.1f}".format(name, seconds * 1000, rss_mb))
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,77 @@
+"""sklearn pipeline vs the same pipeline exported to ONNX, on new-cashnet.csv.
+
+Run from fastapi_project/: python -m benchmarks.onnx_backend [model.pkl] [CSV]
+Needs skl2onnx and onnxruntime. Exports the pickled pipeline, checks that
+onnxruntime predicts like sklearn, then compares single-review latency and
+batched throughput (ONNX_BATCH_SIZE reviews per call) for 1 and all intra-op
+threads.
+Exits with an error if the agreement check fails.
+"""
+
+import os
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+from pathlib import Path
+
+import joblib
+
+from artifact import compare_models
+from backends import ONNX_BATCH_SIZE, OnnxModel, export_onnx
+from dataset import read_dataset
+from preprocessing import clean_batch
+
+
+def single_latency(model, texts, n=1000):
+    timings = []
+    for text in texts[:n]:
+        start = time.perf_counter()
+        model.predict_proba([text])
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), statistics.quantiles(timings, n=100)[98]
+
+
+def batch_throughput(model, texts, batch_size=ONNX_BATCH_SIZE):
+    def run():
+        for i in range(0, len(texts), batch_size):
+            model.predict_proba(texts[i : i + batch_size])
+
+    return len(texts) / min(timeit.repeat(run, number=1, repeat=3))
+
+
+def main(pickle_path="model.pkl", data_path="new-cashnet.csv"):
+    pipeline = joblib.load(pickle_path)
+    texts = clean_batch(
+        read_dataset(data_path, columns=["reviews"])["reviews"]
+    ).tolist()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "model.onnx"
+        export_onnx(pipeline, path)
+        models = {"sklearn": pipeline}
+        for threads in sorted({1, os.cpu_count()}):
+            models[f"onnxruntime ({threads} threads)"] = OnnxModel(
+                path, intra_op_threads=threads
+            )
+        check = compare_models(pipeline, models["onnxruntime (1 threads)"], texts)
+
+    print(
+        "{:<28}{:>10}{:>10}{:>16}".format(
+            "backend", "p50 us", "p99 us", "batch reviews/s"
+        )
+    )
+    for name, model in models.items():
+        p50, p99 = single_latency(model, texts)
+        print(
+            "{:<28}{:>10.0f}{:>10.0f}{:>16.0f}".format(
+                name, p50 * 1e6, p99 * 1e6, batch_throughput(model, texts)
+            )
+        )
+    print("onnxruntime vs sklearn:", check)
+    return check["ok"]
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main(*sys.argv[1:]) else 1)
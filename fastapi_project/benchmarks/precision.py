@@ -0,0 +1,52 @@
+"""float32 vs float64 model artifacts on new-cashnet.csv.
+
+Run from fastapi_project/: python -m benchmarks.precision [model.pkl] [CSV]
+Exports the pickled pipeline in both precisions, checks that the float32
+predictions agree with the float64 ones and compares size and speed.
+Exits with an error if the agreement check fails.
+"""
+
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+import joblib
+
+from artifact import compare_models, export_model, load_model
+from dataset import read_dataset
+from preprocessing import clean_batch
+
+
+def main(pickle_path="model.pkl", data_path="new-cashnet.csv"):
+    pipeline = joblib.load(pickle_path)
+    texts = clean_batch(
+        read_dataset(data_path, columns=["reviews"])["reviews"]
+    ).tolist()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        models = {}
+        for dtype in ("float64", "float32"):
+            export_model(pipeline, Path(tmp) / dtype, dtype=dtype)
+            models[dtype] = load_model(Path(tmp) / dtype)
+            size = sum(f.stat().st_size for f in (Path(tmp) / dtype).glob("*.npy"))
+            seconds = min(
+                timeit.repeat(
+                    lambda: models[dtype].predict_proba(texts), number=1, repeat=5
+                )
+            )
+            print(
+                "{}: arrays {:.1f} KiB, {:.0f} reviews/s".format(
+                    dtype, size / 1024, len(texts) / seconds
+                )
+            )
+
+        reference = compare_models(pipeline, models["float64"], texts)
+        check = compare_models(models["float64"], models["float32"], texts)
+    print("float64 artifact vs sklearn:", reference)
+    print("float32 vs float64:", check)
+    return check["ok"]
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main(*sys.argv[1:]) else 1)
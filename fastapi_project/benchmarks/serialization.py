@@ -0,0 +1,65 @@
+"""Serialization cost of prediction responses.
+
+Run from fastapi_project/: python -m benchmarks.serialization
+"""
+
+import timeit
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+# the same choice as main.py, without importing the app (and its model)
+try:
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as PredictionResponse
+except ImportError:
+    PredictionResponse = JSONResponse
+
+SIZES = (1, 100, 10_000)
+
+
+def make_payload(size, numeric=True):
+    score = 0.93 if numeric else "0.93"
+    return [{"prediction": "Positive", "score": score} for _ in range(size)]
+
+
+def default_path(payload):
+    # what FastAPI does with a returned dict: encode, then render
+    return JSONResponse(jsonable_encoder(payload)).body
+
+
+def direct_json(payload):
+    return JSONResponse(payload).body
+
+
+def fast_response(payload):
+    return PredictionResponse(payload).body
+
+
+def run(repeat=5):
+    print(
+        "{:>8} {:>28} {:>14} {:>14}".format(
+            "items",
+            "encoder (str scores) µs",
+            "json µs",
+            PredictionResponse.__name__ + " µs",
+        )
+    )
+    for size in SIZES:
+        number = max(1, 10_000 // size)
+        timings = []
+        for function, numeric in (
+            (default_path, False),
+            (direct_json, True),
+            (fast_response, True),
+        ):
+            payload = make_payload(size, numeric)
+            best = min(
+                timeit.repeat(lambda: function(payload), number=number, repeat=repeat)
+            )
+            timings.append(best / number * 1e6)
+        print("{:>8} {:>28.1f} {:>14.1f} {:>14.1f}".format(size, *timings))
+
+
+if __name__ == "__main__":
+    run()
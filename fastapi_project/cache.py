@@ -0,0 +1,168 @@
+"""Prediction cache shared by the uvicorn workers of a host.
+
+A SQLite file in WAL mode: readers never wait for the writer, and every
+worker process sees what the others scored. Rows are keyed by a 16-byte
+BLAKE2 digest of the model version and the cleaned review, so the review
+text itself is not stored and a new model never reads stale predictions.
+Every EVICT_EVERY writes of a worker, the table is cut back to the last
+PREDICTION_CACHE_SIZE rows written (re-scoring a review moves it to the
+end), so it never grows much beyond that size. The cache is best
+effort: a lookup or write that fails, e.g. because another worker holds
+the write lock for too long, is counted and treated as a miss.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from profiling import LATENCY_WINDOW, latency_summary
+
+PREDICTION_CACHE = os.environ.get("PREDICTION_CACHE")
+PREDICTION_CACHE_SIZE = int(os.environ.get("PREDICTION_CACHE_SIZE", 1_000_000))
+# a writer gives up after this many seconds instead of holding a request
+BUSY_TIMEOUT = 0.05
+EVICT_EVERY = 1000
+# SQLite's default limit of bound parameters is 999
+LOOKUP_CHUNK = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY,
+    key BLOB NOT NULL UNIQUE,
+    positive REAL NOT NULL
+)
+"""
+
+
+def cache_key(version, text):
+    return hashlib.blake2b(
+        version.encode() + b"\0" + text.encode(), digest_size=16
+    ).digest()
+
+
+class PredictionCache:
+    def __init__(self, path=PREDICTION_CACHE, max_entries=PREDICTION_CACHE_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._since_eviction = 0
+
+        # workers may start at the same time: wait for each other here only
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(SCHEMA)
+        conn.close()
+
+    def _connection(self):
+        # one connection per thread (the threadpool reuses its threads)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path,
+                timeout=BUSY_TIMEOUT,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            # a lost write only costs a model call: no fsync per commit
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("PRAGMA mmap_size=268435456")
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, version, texts):
+        # cached positive probabilities, None for the misses
+        start = time.perf_counter()
+        keys = [cache_key(version, text) for text in texts]
+        found = {}
+        try:
+            conn = self._connection()
+            for i in range(0, len(keys), LOOKUP_CHUNK):
+                chunk = keys[i : i + LOOKUP_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                found.update(
+                    conn.execute(
+                        "SELECT key, positive FROM predictions "
+                        "WHERE key IN ({})".format(placeholders),
+                        chunk,
+                    )
+                )
+        except sqlite3.Error:
+            self.errors += 1
+        positives = [found.get(key) for key in keys]
+        self._latencies.append(time.perf_counter() - start)
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return positives
+
+    def put_many(self, version, texts, positives):
+        rows = [
+            (cache_key(version, text), positive)
+            for text, positive in zip(texts, positives)
+        ]
+        conn = None
+        try:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR REPLACE INTO predictions (key, positive) VALUES (?, ?)", rows
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            if conn is not None and conn.in_transaction:
+                conn.execute("ROLLBACK")
+            self.errors += 1
+            return
+        with self._lock:
+            self.writes += len(rows)
+            self._since_eviction += len(rows)
+            evict = self._since_eviction >= EVICT_EVERY
+            if evict:
+                self._since_eviction = 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        # ids grow with every write: keep the last max_entries of them
+        try:
+            self._connection().execute(
+                "DELETE FROM predictions "
+                "WHERE id <= (SELECT max(id) FROM predictions) - ?",
+                (self.max_entries,),
+            )
+        except sqlite3.Error:
+            self.errors += 1
+
+    def stats(self):
+        latencies = list(self._latencies)
+        lookups = self.hits + self.misses
+        report = {
+            "path": self.path,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "writes": self.writes,
+            "errors": self.errors,
+        }
+        try:
+            # an upper bound: replaced rows leave gaps in the ids
+            report["entries"] = (
+                self._connection()
+                .execute("SELECT coalesce(max(id) - min(id) + 1, 0) FROM predictions")
+                .fetchone()[0]
+            )
+        except sqlite3.Error:
+            pass
+        if len(latencies) >= 2:
+            report["lookup_ms"] = latency_summary(latencies)
+        return report
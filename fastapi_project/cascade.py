@@ -0,0 +1,108 @@
+"""Lexicon pre-scorer in front of the model.
+
+The fitted TF-IDF + MultinomialNB pipeline is linear in the TF-IDF vector:
+its log-odds are the class log-prior difference plus the sum of each term's
+weight times the difference of its two class log-probabilities. Lexicon keeps
+that per-token table and scores a cleaned review with a regex and a few dict
+lookups. Only reviews whose probability reaches the threshold are answered
+this way, the others still go to the model. For unigram models the lexicon
+gives the model's own probabilities; with n-grams it only holds the unigram
+weights and is an approximation (benchmarks/cascade.py measures the impact).
+"""
+
+import math
+import os
+import re
+from collections import Counter
+
+# cascade off unless a threshold is set, e.g. CASCADE_THRESHOLD=0.99
+CASCADE_THRESHOLD = os.environ.get("CASCADE_THRESHOLD")
+
+
+def model_parameters(model):
+    # vectorizer settings and NB parameters of a sklearn pipeline or a CompactModel
+    if hasattr(model, "named_steps"):
+        vectorizer = model.named_steps.get("tfidf")
+        classifier = model.named_steps.get("classifier")
+        if vectorizer is None or not hasattr(vectorizer, "vocabulary_"):
+            raise ValueError("the lexicon needs a fitted TfidfVectorizer")
+        return {
+            "vocabulary": vectorizer.vocabulary_,
+            "idf": vectorizer.idf_ if vectorizer.use_idf else None,
+            "settings": vectorizer,
+            "sublinear_tf": vectorizer.sublinear_tf,
+            "norm": vectorizer.norm,
+            "feature_log_prob": classifier.feature_log_prob_,
+            "class_log_prior": classifier.class_log_prior_,
+        }
+    if hasattr(model, "feature_log_prob"):
+        return {
+            "vocabulary": model.vectorizer.vocabulary,
+            "idf": model.idf if model.use_idf else None,
+            "settings": model.vectorizer,
+            "sublinear_tf": model.sublinear_tf,
+            "norm": model.norm,
+            "feature_log_prob": model.feature_log_prob,
+            "class_log_prior": model.class_log_prior,
+        }
+    raise ValueError("the lexicon needs a TF-IDF + MultinomialNB model")
+
+
+class Lexicon:
+    def __init__(self, model, threshold):
+        params = model_parameters(model)
+        settings = params["settings"]
+        if len(params["class_log_prior"]) != 2:
+            raise ValueError("the lexicon only scores two classes")
+        if settings.analyzer != "word" or settings.tokenizer or settings.preprocessor:
+            raise ValueError("the lexicon only supports the default word analyzer")
+
+        self.threshold = threshold
+        self.lowercase = settings.lowercase
+        self.token_pattern = re.compile(settings.token_pattern)
+        self.exact = tuple(settings.ngram_range) == (1, 1)
+        self.sublinear_tf = params["sublinear_tf"]
+        self.norm = params["norm"]
+        self.bias = float(params["class_log_prior"][1] - params["class_log_prior"][0])
+
+        log_odds = (
+            params["feature_log_prob"][1] - params["feature_log_prob"][0]
+        ).tolist()
+        idf = params["idf"].tolist() if params["idf"] is not None else None
+        # token -> (idf, log-odds weight)
+        self.weights = {
+            term: (idf[i] if idf else 1.0, log_odds[i])
+            for term, i in params["vocabulary"].items()
+            if " " not in term
+        }
+
+    def positive_probability(self, text):
+        if self.lowercase:
+            text = text.lower()
+        counts = Counter(self.token_pattern.findall(text))
+        values = []
+        for token, count in counts.items():
+            entry = self.weights.get(token)
+            if entry is not None:
+                tf = 1 + math.log(count) if self.sublinear_tf else count
+                values.append((tf * entry[0], entry[1]))
+        if self.norm == "l2":
+            norm = math.sqrt(sum(value * value for value, _ in values))
+        elif self.norm == "l1":
+            norm = sum(value for value, _ in values)
+        else:
+            norm = 1.0
+        log_odds = self.bias
+        if norm:
+            log_odds += sum(value * weight for value, weight in values) / norm
+        if log_odds < 0:
+            odds = math.exp(log_odds)
+            return odds / (1 + odds)
+        return 1 / (1 + math.exp(-log_odds))
+
+    def score(self, text):
+        # probability of the positive class, or None when the model must decide
+        probability = self.positive_probability(text)
+        if max(probability, 1 - probability) >= self.threshold:
+            return probability
+        return None
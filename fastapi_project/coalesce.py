@@ -0,0 +1,55 @@
+"""Single-flight coalescing of identical in-flight reviews.
+
+Concurrent requests for the same key (the model and the cleaned review)
+share one inference: the first one starts it as a task, the others await
+the same task, and the key is forgotten as soon as the result is there. The
+task is shielded, so a client that disconnects does not cancel the
+inference for the requests waiting on it.
+"""
+
+import asyncio
+
+
+class SingleFlight:
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self.batch_duplicates = 0
+        self._flights = {}
+
+    async def run(self, key, func, *args):
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args))
+            self._flights[key] = task
+            task.add_done_callback(lambda task: self._done(key, task))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        # retrieve the error even if every waiter went away
+        if not task.cancelled():
+            task.exception()
+
+    def unique(self, texts):
+        # identical reviews of one batch are scored once: the distinct texts
+        # and, for each review, the index of its text among them
+        positions = {}
+        indices = [positions.setdefault(text, len(positions)) for text in texts]
+        self.batch_duplicates += len(texts) - len(positions)
+        return list(positions), indices
+
+    def stats(self):
+        requests = self.leaders + self.coalesced
+        return {
+            "requests": requests,
+            "inferences": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_rate": round(self.coalesced / requests, 4) if requests else None,
+            "in_flight": len(self._flights),
+            "batch_duplicates": self.batch_duplicates,
+        }
@@ -0,0 +1,165 @@
+"""Columnar, memory-mapped storage for the review datasets.
+
+    python dataset.py data/new-cashnet.csv data/new-cashnet
+
+converts a CSV once into a directory of NumPy arrays: numeric columns are
+stored as-is and text columns as one UTF-8 buffer plus an offsets array.
+load() memory-maps only the requested columns, so nothing is parsed again
+and unused columns are never read.
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+FORMAT_VERSION = 1
+TEXT_COLUMNS = ("Title", "reviews")
+NUMERIC_COLUMNS = {"stars": np.int8, "sentiment": np.int8}
+
+
+class TextColumn:
+    """Strings stored as a UTF-8 buffer and the offsets of each string."""
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.data[self.offsets[i] : self.offsets[i + 1]]).decode()
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def to_list(self):
+        # one copy of the (sliced) column buffer, then plain bytes slicing
+        base = int(self.offsets[0]) if len(self.offsets) else 0
+        offsets = [offset - base for offset in self.offsets.tolist()]
+        data = self.data[base : base + offsets[-1]].tobytes() if offsets else b""
+        return [
+            data[start:end].decode() for start, end in zip(offsets[:-1], offsets[1:])
+        ]
+
+    def to_series(self):
+        return pd.Series(self.to_list(), dtype=object)
+
+    def slice(self, start, stop):
+        # TextColumn of rows [start, stop), still backed by the memory map
+        return TextColumn(self.data, self.offsets[start : stop + 1])
+
+
+def convert(csv_path, out_dir, chunksize=100_000):
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    texts = {}
+    numbers = {}
+    rows = 0
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+        for column in chunk.columns:
+            if column in NUMERIC_COLUMNS:
+                numbers.setdefault(column, []).append(
+                    chunk[column].to_numpy(NUMERIC_COLUMNS[column])
+                )
+            elif column in TEXT_COLUMNS:
+                files = texts.get(column)
+                if files is None:
+                    files = texts[column] = (
+                        open(out_dir / f"{column}.data", "wb"),
+                        [0],
+                    )
+                data, offsets = files
+                for value in chunk[column].fillna(""):
+                    encoded = value.encode()
+                    data.write(encoded)
+                    offsets.append(offsets[-1] + len(encoded))
+        rows += len(chunk)
+
+    columns = {}
+    for column, (data, offsets) in texts.items():
+        data.close()
+        np.save(out_dir / f"{column}.offsets.npy", np.array(offsets, dtype=np.int64))
+        columns[column] = "text"
+    for column, parts in numbers.items():
+        np.save(out_dir / f"{column}.npy", np.concatenate(parts))
+        columns[column] = str(NUMERIC_COLUMNS[column]().dtype)
+
+    manifest = {"version": FORMAT_VERSION, "rows": rows, "columns": columns}
+    with open(out_dir / "manifest.json", "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load(path, columns=None):
+    # returns {column: np.memmap | TextColumn}, without reading the data
+    path = Path(path)
+    with open(path / "manifest.json") as f:
+        manifest = json.load(f)
+    if manifest["version"] != FORMAT_VERSION:
+        raise ValueError(f"unsupported dataset version {manifest['version']}")
+
+    loaded = {}
+    for column in columns or manifest["columns"]:
+        kind = manifest["columns"][column]
+        if kind == "text":
+            data_path = path / f"{column}.data"
+            # np.memmap refuses empty files
+            if data_path.stat().st_size:
+                data = np.memmap(data_path, dtype=np.uint8, mode="r")
+            else:
+                data = np.empty(0, dtype=np.uint8)
+            offsets = np.load(path / f"{column}.offsets.npy", mmap_mode="r")
+            loaded[column] = TextColumn(data, offsets)
+        else:
+            loaded[column] = np.load(path / f"{column}.npy", mmap_mode="r")
+    return loaded
+
+
+def read_dataset(path, columns=None):
+    # a DataFrame from either a columnar directory or a CSV file
+    if Path(path).is_dir():
+        loaded = load(path, columns)
+        return pd.DataFrame(
+            {
+                column: values.to_series() if isinstance(values, TextColumn) else values
+                for column, values in loaded.items()
+            }
+        )
+    return pd.read_csv(path, usecols=columns)
+
+
+def read_dataset_chunks(path, columns=None, chunksize=100_000):
+    # DataFrames of at most chunksize rows, from either format
+    if not Path(path).is_dir():
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunksize)
+        return
+
+    loaded = load(path, columns)
+    rows = len(next(iter(loaded.values())))
+    for start in range(0, rows, chunksize):
+        stop = min(start + chunksize, rows)
+        yield pd.DataFrame(
+            {
+                column: values.slice(start, stop).to_list()
+                if isinstance(values, TextColumn)
+                else values[start:stop]
+                for column, values in loaded.items()
+            },
+            index=pd.RangeIndex(start, stop),
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert a review CSV to the columnar format"
+    )
+    parser.add_argument("csv_path")
+    parser.add_argument("out_dir")
+    parser.add_argument("--chunksize", type=int, default=100_000)
+    args = parser.parse_args()
+    print(convert(args.csv_path, args.out_dir, args.chunksize))
@@ -0,0 +1,275 @@
+"""Deduplication of review corpora.
+
+    python dedupe.py data/new-cashnet.csv data/new-cashnet-dedup.csv [--near-duplicates]
+
+Exact duplicates are found with an on-disk hash index of the normalized
+review text (lowercase, punctuation and extra spaces removed), in time
+linear in the number of rows. Near duplicates can optionally be found with
+MinHash signatures and locality-sensitive hashing.
+
+With a label column, a review is only a duplicate of one with the same
+label: the same text under another label is kept (otherwise whichever
+label comes first would win, and short reviews such as "ok" would all
+end up in one class) and counted in label_conflicts.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+INITIAL_CAPACITY = 1 << 20
+MAX_LOAD_FACTOR = 0.5
+
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+NEAR_DUPLICATE_THRESHOLD = 0.8
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def normalize(texts):
+    return (
+        pd.Series(texts, dtype=object)
+        .fillna("")
+        .str.lower()
+        .str.replace(r"[^a-z0-9]+", " ", regex=True)
+        .str.strip()
+    )
+
+
+def hash_texts(texts):
+    # 64-bit hashes, 0 is reserved for empty slots of the index
+    hashes = pd.util.hash_pandas_object(texts, index=False).to_numpy(np.uint64)
+    hashes[hashes == 0] = 1
+    return hashes
+
+
+class HashIndex:
+    """Open-addressing hash set of uint64 keys, stored in a memory-mapped file."""
+
+    def __init__(self, path=None, capacity=INITIAL_CAPACITY):
+        self._temporary = path is None
+        if path is None:
+            fd, path = tempfile.mkstemp(suffix=".index")
+            os.close(fd)
+            os.unlink(path)
+        self.path = path
+
+        if os.path.exists(path) and os.path.getsize(path):
+            self.table = np.memmap(path, dtype=np.uint64, mode="r+")
+        else:
+            self.table = np.memmap(path, dtype=np.uint64, mode="w+", shape=(capacity,))
+        self.count = int(np.count_nonzero(self.table))
+
+    def add(self, hashes):
+        # insert a batch of keys; True where the key was not in the index yet
+        # (within the batch, only the first occurrence counts as new)
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        keys, first = np.unique(hashes, return_index=True)
+        if (self.count + len(keys)) > MAX_LOAD_FACTOR * len(self.table):
+            self._grow(self.count + len(keys))
+
+        inserted = self._insert(keys)
+        is_new = np.zeros(len(hashes), dtype=bool)
+        is_new[first[inserted]] = True
+        return is_new
+
+    def _insert(self, keys):
+        # vectorized linear probing over all the keys of the batch at once
+        table = self.table
+        mask = np.uint64(len(table) - 1)
+        inserted = np.zeros(len(keys), dtype=bool)
+        pending = np.arange(len(keys))
+        slots = keys & mask
+
+        while pending.size:
+            current = table[slots]
+            found = current == keys[pending]
+
+            empty = np.flatnonzero(current == 0)
+            # several keys may probe the same empty slot: the first one wins,
+            # the others see it taken at the next round
+            _, winners = np.unique(slots[empty], return_index=True)
+            winners = empty[winners]
+            table[slots[winners]] = keys[pending[winners]]
+            inserted[pending[winners]] = True
+
+            done = found.copy()
+            done[winners] = True
+            occupied = ~done & (current != 0)
+            slots[occupied] = (slots[occupied] + np.uint64(1)) & mask
+            pending, slots = pending[~done], slots[~done]
+
+        self.count += int(inserted.sum())
+        return inserted
+
+    def _grow(self, needed):
+        capacity = len(self.table)
+        while needed > MAX_LOAD_FACTOR * capacity:
+            capacity *= 2
+        keys = np.asarray(self.table[self.table != 0])
+
+        path = self.path + ".resize"
+        self.table = np.memmap(path, dtype=np.uint64, mode="w+", shape=(capacity,))
+        self.count = 0
+        self._insert(keys)
+        self.table.flush()
+        os.replace(path, self.path)
+
+    def close(self):
+        self.table.flush()
+        del self.table
+        if self._temporary:
+            os.unlink(self.path)
+
+
+class MinHashLSH:
+    """Near-duplicate detection on word trigrams with MinHash and LSH bands.
+
+    Keeps one 32-bit signature per distinct text (4 bytes per permutation).
+    """
+
+    def __init__(
+        self,
+        permutations=MINHASH_PERMUTATIONS,
+        bands=MINHASH_BANDS,
+        threshold=NEAR_DUPLICATE_THRESHOLD,
+        seed=42,
+    ):
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(
+            1, _MERSENNE_PRIME, size=(permutations, 1), dtype=np.uint64
+        )
+        self.b = rng.randint(
+            0, _MERSENNE_PRIME, size=(permutations, 1), dtype=np.uint64
+        )
+        self.rows = permutations // bands
+        self.bands = bands
+        self.threshold = threshold
+        self.buckets = [{} for _ in range(bands)]
+        self.signatures = []
+
+    def signature(self, text):
+        words = text.split()
+        shingles = [" ".join(words[i : i + 3]) for i in range(max(len(words) - 2, 1))]
+        hashes = pd.util.hash_array(np.array(shingles, dtype=object))
+        # one (a * x + b) permutation per row, wrapping around 2**64
+        permuted = (self.a * hashes + self.b) % np.uint64(_MERSENNE_PRIME)
+        return permuted.min(axis=1).astype(np.uint32)
+
+    def add(self, text):
+        # True if the text is a near duplicate of one added before
+        signature = self.signature(text)
+        keys = [
+            signature[band * self.rows : (band + 1) * self.rows].tobytes()
+            for band in range(self.bands)
+        ]
+        for band, key in enumerate(keys):
+            candidate = self.buckets[band].get(key)
+            if candidate is not None:
+                similarity = (self.signatures[candidate] == signature).mean()
+                if similarity >= self.threshold:
+                    return True
+
+        self.signatures.append(signature)
+        for band, key in enumerate(keys):
+            self.buckets[band].setdefault(key, len(self.signatures) - 1)
+        return False
+
+
+class Deduplicator:
+    """Streaming deduplication: call keep() on successive chunks."""
+
+    def __init__(
+        self,
+        index_path=None,
+        near_duplicates=False,
+        threshold=NEAR_DUPLICATE_THRESHOLD,
+        by_label=False,
+    ):
+        self.index = HashIndex(index_path)
+        # with labels: the texts seen under any label, to count the conflicts
+        self.texts = (
+            HashIndex(index_path and index_path + ".texts") if by_label else None
+        )
+        self.near_duplicates = near_duplicates
+        self.threshold = threshold
+        self.lsh = {}  # label (None without labels) -> MinHashLSH
+        self.stats = {
+            "rows": 0,
+            "exact_duplicates": 0,
+            "near_duplicates": 0,
+            "label_conflicts": 0,
+            "kept": 0,
+        }
+
+    def keep(self, texts, labels=None):
+        # boolean mask of the rows to keep; labels only with by_label=True
+        normalized = normalize(texts)
+        hashes = hash_texts(normalized)
+        if labels is None:
+            keep = self.index.add(hashes)
+        else:
+            labels = np.asarray(labels).astype(str)
+            keep = self.index.add(hash_texts(normalized + "\0" + labels))
+            new_text = self.texts.add(hashes)
+            self.stats["label_conflicts"] += int((keep & ~new_text).sum())
+        self.stats["exact_duplicates"] += int((~keep).sum())
+
+        if self.near_duplicates:
+            for i in np.flatnonzero(keep):
+                label = None if labels is None else labels[i]
+                if label not in self.lsh:
+                    self.lsh[label] = MinHashLSH(threshold=self.threshold)
+                if self.lsh[label].add(normalized.iat[i]):
+                    keep[i] = False
+                    self.stats["near_duplicates"] += 1
+
+        self.stats["rows"] += len(keep)
+        self.stats["kept"] += int(keep.sum())
+        return keep
+
+    def close(self):
+        self.index.close()
+        if self.texts is not None:
+            self.texts.close()
+
+
+def deduplicate(
+    frame, column="reviews", index_path=None, near_duplicates=False, label=None
+):
+    deduplicator = Deduplicator(index_path, near_duplicates, by_label=label is not None)
+    try:
+        keep = deduplicator.keep(frame[column], None if label is None else frame[label])
+    finally:
+        deduplicator.close()
+    return frame[keep].reset_index(drop=True), deduplicator.stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove duplicate reviews from a CSV")
+    parser.add_argument("input_path")
+    parser.add_argument("output_path")
+    parser.add_argument("--column", default="reviews")
+    parser.add_argument(
+        "--label", help="label column: only dedupe reviews with the same label"
+    )
+    parser.add_argument("--index", help="hash index file, kept between runs")
+    parser.add_argument("--near-duplicates", action="store_true")
+    parser.add_argument("--chunksize", type=int, default=100_000)
+    args = parser.parse_args()
+
+    deduplicator = Deduplicator(
+        args.index, args.near_duplicates, by_label=args.label is not None
+    )
+    with open(args.output_path, "w", newline="") as out:
+        for chunk in pd.read_csv(args.input_path, chunksize=args.chunksize):
+            labels = None if args.label is None else chunk[args.label]
+            chunk[deduplicator.keep(chunk[args.column], labels)].to_csv(
+                out, header=out.tell() == 0, index=False
+            )
+    deduplicator.close()
+    print(json.dumps(deduplicator.stats))
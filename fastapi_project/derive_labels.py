@@ -0,0 +1,87 @@
+"""Derive the training file from a raw review export.
+
+    python derive_labels.py data/02-cashnet.csv data/new-cashnet.csv
+
+Streams the export in chunks: maps stars to a sentiment label (1-2 stars:
+0, 3-5 stars: 1), drops incomplete rows and duplicate reviews (same
+normalized text and label; the same text under both labels is kept and
+counted in label_conflicts), and appends each chunk to the output. Memory
+stays bounded by the chunk size: seen reviews are tracked in the on-disk
+hash index of dedupe.py.
+"""
+
+import argparse
+import os
+import resource
+import time
+
+import numpy as np
+import pandas as pd
+
+from dedupe import Deduplicator
+
+# index: number of stars, value: sentiment (-1 for invalid star counts)
+STAR_TO_SENTIMENT = np.array([-1, 0, 0, 1, 1, 1], dtype=np.int8)
+
+
+def derive_labels(input_path, output_path, chunksize=100_000, index_path=None):
+    stats = {
+        "rows_in": 0,
+        "incomplete": 0,
+        "invalid_stars": 0,
+        "duplicates": 0,
+        "label_conflicts": 0,
+        "rows_out": 0,
+    }
+    deduplicator = Deduplicator(index_path, by_label=True)
+
+    with open(output_path, "w", newline="") as out:
+        for chunk in pd.read_csv(input_path, chunksize=chunksize):
+            stats["rows_in"] += len(chunk)
+
+            complete = chunk.dropna(axis=0, how="any")
+            stats["incomplete"] += len(chunk) - len(complete)
+
+            stars = pd.to_numeric(complete["stars"], errors="coerce").to_numpy()
+            valid = np.isin(stars, np.arange(1, 6))
+            stats["invalid_stars"] += int((~valid).sum())
+            labelled = complete[valid].copy()
+            labelled["sentiment"] = STAR_TO_SENTIMENT[stars[valid].astype(np.intp)]
+
+            # duplicates of the normalized review text and label, within and
+            # across chunks
+            keep = deduplicator.keep(labelled["reviews"], labelled["sentiment"])
+            stats["duplicates"] += int((~keep).sum())
+
+            kept = labelled[keep]
+            kept.to_csv(out, header=out.tell() == 0, index=False)
+            stats["rows_out"] += len(kept)
+    deduplicator.close()
+    stats["label_conflicts"] = deduplicator.stats["label_conflicts"]
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Derive sentiment labels from a raw review export"
+    )
+    parser.add_argument("input_path")
+    parser.add_argument("output_path")
+    parser.add_argument("--chunksize", type=int, default=100_000)
+    parser.add_argument("--index", help="hash index file, to dedupe across runs")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    stats = derive_labels(args.input_path, args.output_path, args.chunksize, args.index)
+    elapsed = time.perf_counter() - t0
+
+    size_mb = os.path.getsize(args.input_path) / 1e6
+    print(stats)
+    print(
+        "{:.2f}s, {:.0f} rows/s, {:.1f} MB/s, peak RSS {:.0f} MB".format(
+            elapsed,
+            stats["rows_in"] / elapsed,
+            size_mb / elapsed,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        )
+    )
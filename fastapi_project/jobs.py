@@ -0,0 +1,151 @@
+"""Background scoring jobs for large review exports.
+
+A CSV is uploaded once, scored chunk by chunk in a worker pool and written
+to a scored CSV that can be downloaded when the job is done.
+
+Everything about a job lives in its directory under JOBS_DIR, including its
+status (status.json, replaced atomically at every update), so any uvicorn
+worker can answer for a job that another one runs. Jobs not updated for
+JOB_RETENTION seconds are removed when the next job is submitted.
+"""
+
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+JOBS_DIR = Path(
+    os.environ.get("JOBS_DIR", Path(tempfile.gettempdir()) / "sentiment-jobs")
+)
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_CHUNKSIZE = int(os.environ.get("JOB_CHUNKSIZE", 1000))
+JOB_RETENTION = float(os.environ.get("JOB_RETENTION", 24 * 3600))
+
+JOB_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+class ScoringJobs:
+    def __init__(
+        self,
+        score_batch,
+        jobs_dir=JOBS_DIR,
+        workers=JOB_WORKERS,
+        chunksize=JOB_CHUNKSIZE,
+        retention=JOB_RETENTION,
+    ):
+        # score_batch takes a list of reviews and returns (predictions, scores)
+        self.score_batch = score_batch
+        self.jobs_dir = Path(jobs_dir)
+        self.chunksize = chunksize
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="scoring-job"
+        )
+        self._lock = threading.Lock()
+
+    def submit(self, upload, owner):
+        self.sweep()
+        # copy the upload to disk so the request can return right away
+        job_id = uuid.uuid4().hex
+        job_dir = self.jobs_dir / job_id
+        job_dir.mkdir(parents=True)
+        source = job_dir / "input.csv"
+        with open(source, "wb") as f:
+            shutil.copyfileobj(upload, f)
+
+        self._write(
+            job_id,
+            {
+                "job_id": job_id,
+                "owner": owner,
+                "status": "pending",
+                "rows": 0,
+                "progress": 0.0,
+                "error": None,
+            },
+        )
+        self._executor.submit(self._run, job_id, source, job_dir / "scored.csv")
+        return job_id
+
+    def status(self, job_id, owner):
+        job = self._read(job_id)
+        if job is None or job["owner"] != owner:
+            return None
+        return job
+
+    def result_path(self, job_id):
+        return self.jobs_dir / job_id / "scored.csv"
+
+    def sweep(self):
+        # remove the jobs not updated within the retention period, whatever
+        # their status: a running job updates its status at every chunk
+        if not self.jobs_dir.is_dir():
+            return
+        cutoff = time.time() - self.retention
+        for job_dir in self.jobs_dir.iterdir():
+            status = job_dir / "status.json"
+            try:
+                updated = (status if status.exists() else job_dir).stat().st_mtime
+            except FileNotFoundError:
+                continue  # removed by another worker meanwhile
+            if updated < cutoff:
+                shutil.rmtree(job_dir, ignore_errors=True)
+
+    def _read(self, job_id):
+        if not JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        try:
+            with open(self.jobs_dir / job_id / "status.json") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write(self, job_id, job):
+        # readers in other workers see the old status or the new one, whole
+        status = self.jobs_dir / job_id / "status.json"
+        partial = status.with_suffix(".tmp")
+        with open(partial, "w") as f:
+            json.dump(job, f)
+        partial.replace(status)
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._read(job_id)
+            job.update(fields)
+            self._write(job_id, job)
+
+    def _run(self, job_id, source, result):
+        self._update(job_id, status="running")
+        size = source.stat().st_size or 1
+        partial = result.with_suffix(".part")
+        rows = 0
+        try:
+            # only one chunk of the export is held in memory at a time
+            with open(source, "rb") as f, open(partial, "w", newline="") as out:
+                for chunk in pd.read_csv(f, chunksize=self.chunksize):
+                    if "reviews" not in chunk:
+                        raise ValueError("the CSV has no 'reviews' column")
+                    reviews = chunk["reviews"].fillna("").astype(str).tolist()
+                    chunk["prediction"], chunk["score"] = self.score_batch(reviews)
+                    chunk.to_csv(out, header=rows == 0, index=False)
+
+                    rows += len(chunk)
+                    self._update(
+                        job_id, rows=rows, progress=round(min(f.tell() / size, 1.0), 4)
+                    )
+            partial.replace(result)
+            source.unlink()
+            self._update(job_id, status="done", progress=1.0)
+        except Exception as e:
+            # keep only the status of a failed job
+            partial.unlink(missing_ok=True)
+            source.unlink(missing_ok=True)
+            self._update(job_id, status="failed", error=str(e))
@@ -1,44 +1,189 @@
-import re
+import json
+import logging
+import math
+import os
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
 from typing import Optional, Union
 
-import joblib
 import nltk
 import uvicorn
-from fastapi import Depends, FastAPI, Header, HTTPException, status
+from fastapi import (
+    Depends,
+    FastAPI,
+    File,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    UploadFile,
+    status,
+)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials, OAuth2PasswordBearer
-from nltk.corpus import stopwords
 from passlib.context import CryptContext
-from pydantic import BaseModel
+from pydantic import BaseModel, confloat
+from starlette.exceptions import HTTPException as StarletteHTTPException
+
+try:
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as PredictionResponse
+except ImportError:
+    from fastapi.responses import JSONResponse as PredictionResponse
+
+from admission import AdmissionController
+from backends import load_backend, model_versions
+from cache import PREDICTION_CACHE, PredictionCache
+from cascade import CASCADE_THRESHOLD, Lexicon
+from coalesce import SingleFlight
+from jobs import ScoringJobs
+from middleware import (
+    AdmissionControlMiddleware,
+    RequestDecompressionMiddleware,
+    ResponseCompressionMiddleware,
+)
+from online import OnlineLearner, supports_online_learning
+from prediction import FeedbackBatch, Prediction, PredictionBatch
+from preprocessing import clean_batch, lemmatizer, text_cleaning
+from ratelimit import (
+    USER_BURST,
+    USER_RATE_LIMIT,
+    USER_WEIGHT,
+    FairScheduler,
+    RateLimiter,
+)
+from registry import ModelRegistry
+from shadow import ShadowScorer
+from streaming import NDJSONStreamingResponse, dump_results, ndjson_batches
+from warmup import warm_up
 
-nltk.download("stopwords")
+for dependency in ("stopwords", "wordnet", "omw-1.4"):
+    nltk.download(dependency)
 app = FastAPI(
     title="Analyse des Sentiments",
     description="Une API pour analyser les sentiments des avis Trustpilot",
     version="1.0",
 )
-
-
-# class Prediction(BaseModel):
-#     review: str
+app.add_middleware(RequestDecompressionMiddleware)
+app.add_middleware(
+    ResponseCompressionMiddleware,
+    paths=("/sentiments-prediction", "/user", "/jobs"),
+    exclude=("/sentiments-prediction/stream",),
+)
 
 
 class Users(BaseModel):
     username: str
     password: str
+    # requests per second (0: unlimited), bucket size and fair-queue weight;
+    # None: the USER_* defaults
+    rate_limit: Optional[confloat(ge=0)] = None
+    burst: Optional[confloat(ge=1)] = None
+    weight: Optional[confloat(gt=0)] = None
 
 
 security = HTTPBasic()
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
-with open("model.pkl", "rb") as f:
-    model = joblib.load(f)
-
-
-# class Prediction(BaseModel):
-#     review: str
+# a directory is a memory-mapped artifact exported by sentiment_analysis.py,
+# a .onnx file runs on onnxruntime (threads: ONNX_INTRA_OP_THREADS),
+# anything else a joblib pickle (only load pickles you trust)
+MODEL_PATH = os.environ.get("MODEL_PATH", "model.pkl")
+model = load_backend(MODEL_PATH)
+
+
+logger = logging.getLogger("uvicorn.error")
+
+
+# reviews the lexicon of the default model is confident about (probability of
+# at least CASCADE_THRESHOLD) are answered without calling the model
+def build_cascade(current_model):
+    # None when disabled, or when the model has no lexicon (ONNX, hashing)
+    if not CASCADE_THRESHOLD:
+        return None
+    try:
+        return Lexicon(current_model, float(CASCADE_THRESHOLD))
+    except ValueError as e:
+        logger.warning("Cascade disabled: %s", e)
+        return None
+
+
+cascade = build_cascade(model)
+# digest of the loaded file: every update of the model derives its version
+# from it, so the version keeps the same length however many updates happen
+BASE_MODEL_VERSION = model_versions[model]
+
+
+def swap_model(updated):
+    # a single assignment: requests in flight keep the model they started with;
+    # the updated model is private to this worker, its version too. Nothing
+    # here may raise: the online learner already serves the updated model
+    global model, cascade
+    model_versions[updated] = "{}+{}.{}".format(
+        BASE_MODEL_VERSION, os.getpid(), time.monotonic_ns()
+    )
+    cascade, model = build_cascade(updated), updated
+
+
+# corrected labels from POST /feedback are learned in batches (sklearn
+# pipelines only); ONLINE_MODEL_PATH keeps the updated model across restarts.
+# Updates stay in the worker that learned them, so online learning needs a
+# single worker: on by default with WORKERS=1 only, and ONLINE_LEARNING=1
+# with more workers refuses to start
+WORKERS = int(os.environ.get("WORKERS", 1))
+ONLINE_LEARNING = os.environ.get("ONLINE_LEARNING", "1" if WORKERS == 1 else "0") == "1"
+if ONLINE_LEARNING and WORKERS > 1:
+    raise RuntimeError(
+        "Online learning needs a single worker: set WORKERS=1 or ONLINE_LEARNING=0"
+    )
+ONLINE_MODEL_PATH = os.environ.get("ONLINE_MODEL_PATH")
+online_learner = None
+if ONLINE_LEARNING and supports_online_learning(model):
+    online_learner = OnlineLearner(model, swap_model, save_path=ONLINE_MODEL_PATH)
+
+# a candidate model scored in the background on a sample of the default
+# model's requests and calls (SHADOW_SAMPLE_RATE), compared at GET /shadow
+SHADOW_MODEL = os.environ.get("SHADOW_MODEL")
+shadow_scorer = ShadowScorer(load_backend(SHADOW_MODEL)) if SHADOW_MODEL else None
+
+# identical reviews scored at the same time share one inference
+# (COALESCE_REQUESTS=0 scores single reviews inline on the event loop instead)
+COALESCE_REQUESTS = os.environ.get("COALESCE_REQUESTS", "1") != "0"
+inflight = SingleFlight()
+
+# predictions shared by the workers of this host in a SQLite file
+# (PREDICTION_CACHE=/path/to/cache.sqlite), keyed by model version and review
+prediction_cache = PredictionCache() if PREDICTION_CACHE else None
+
+# per-client models under MODELS_DIR, picked with ?model=name or ?model=name:version
+registry = ModelRegistry()
+
+
+async def selected_model(model_name: Optional[str] = Query(None, alias="model")):
+    # None scores with the default model; loading a model from disk
+    # runs in the threadpool, a loaded one is returned right away
+    if model_name is None:
+        return None
+    scorer = registry.peek(model_name)
+    if scorer is None:
+        try:
+            scorer = await run_in_threadpool(registry.get, model_name)
+        except KeyError:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Model {} not found".format(model_name),
+            )
+    return scorer
+
+
+# lemmas precomputed on the training vocabulary by sentiment_analysis.py
+LEMMA_TABLE = os.environ.get("LEMMA_TABLE", "lemmas.json")
+if Path(LEMMA_TABLE).exists():
+    lemmatizer.load(LEMMA_TABLE)
 
 admin = {
     "admin": {
@@ -51,17 +196,38 @@ users_db = {
     "ali": {
         "username": "ali",
         "password": pwd_context.hash("AZ12345"),
+        "rate_limit": USER_RATE_LIMIT,
+        "burst": USER_BURST,
+        "weight": USER_WEIGHT,
     },
     "dan": {
         "username": "dan",
         "password": pwd_context.hash("DA12345"),
+        "rate_limit": USER_RATE_LIMIT,
+        "burst": USER_BURST,
+        "weight": USER_WEIGHT,
     },
     "andre": {
         "username": "andre",
         "password": pwd_context.hash("AN12345"),
+        "rate_limit": USER_RATE_LIMIT,
+        "burst": USER_BURST,
+        "weight": USER_WEIGHT,
     },
 }
 
+# bounded in-flight requests and queue per worker on the prediction routes,
+# 503 + Retry-After beyond, and a bounded share of them per user (429);
+# added last so it runs first, before the body is decompressed or read
+admission = AdmissionController()
+app.add_middleware(
+    AdmissionControlMiddleware,
+    controller=admission,
+    paths=("/sentiments-prediction",),
+    exclude=("/sentiments-prediction/stream",),
+    users=users_db,
+)
+
 
 def get_current_admin(credentials: HTTPBasicCredentials = Depends(security)):
     username = credentials.username
@@ -89,48 +255,364 @@ def get_current_user(credentials: HTTPBasicCredentials = Depends(security)):
     return credentials.username
 
 
+# the worker is ready once warm-up is done (dummy inferences, then the most
+# frequent reviews of WARMUP_CORPUS scored into the prediction cache)
+warmup_report = None
+
+
+def run_warm_up():
+    global warmup_report
+    try:
+        report = warm_up(model, score_cleaned)
+    except Exception as e:
+        # serve cold rather than never
+        report = {"error": repr(e)}
+    warmup_report = report
+
+
+@app.on_event("startup")
+def start_warm_up():
+    threading.Thread(target=run_warm_up, name="warm-up", daemon=True).start()
+
+
+@app.get("/ready")
+def ready():
+    if warmup_report is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Warming up"
+        )
+    return {"ready": True, "warm_up": warmup_report}
+
+
+# per-user limits from the user record; admin routes do not go through them
+rate_limiter = RateLimiter()
+fair_scheduler = FairScheduler()
+
+
+def user_setting(username, key, default):
+    value = users_db.get(username, {}).get(key)
+    return default if value is None else value
+
+
+async def rate_limited_user(username: str = Depends(get_current_user)):
+    # on the event loop, not the threadpool: the buckets are not locked
+    wait = rate_limiter.consume(
+        username,
+        user_setting(username, "rate_limit", USER_RATE_LIMIT),
+        user_setting(username, "burst", USER_BURST),
+    )
+    if wait:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Rate limit exceeded",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
+    return username
+
+
+async def scheduled_user(username: str = Depends(rate_limited_user)):
+    # holds one of the fair scheduler's inference slots until the response is sent
+    async with fair_scheduler.slot(
+        username, user_setting(username, "weight", USER_WEIGHT)
+    ):
+        yield username
+
+
 @app.get("/user")
 def current_user(username: str = Depends(get_current_user)):
     return "Hello {}".format(username)
 
 
-# cleaning the data
-def text_cleaning(text, remove_stop_words=True):
-    # Clean the text, with the option to remove stop_words and to lemmatize word
-    # Clean the text
-    text = re.sub(r"[^A-Za-z0-9]", " ", text)
-    text = re.sub(r"\'s", " ", text)
-    text = re.sub(r"http\S+", " link ", text)
-    text = re.sub(r"\b\d+(?:\.\d+)?\s+", "", text)  # remove numbers
+@app.post("/sentiments-prediction", response_class=PredictionResponse)
+async def predict_sentiment(
+    review: str, cleaned_review=Depends(scheduled_user), scorer=Depends(selected_model)
+):
+    predictions, scores = labels_and_scores([await score_review(review, scorer)])
+
+    # returning the response directly skips jsonable_encoder
+    return PredictionResponse({"prediction": predictions[0], "score": scores[0]})
+
+
+@app.post("/sentiments-prediction/review", response_class=PredictionResponse)
+async def predict_sentiment_body(
+    data: Prediction, username=Depends(scheduled_user), scorer=Depends(selected_model)
+):
+    predictions, scores = labels_and_scores([await score_review(data.review, scorer)])
+    return PredictionResponse({"prediction": predictions[0], "score": scores[0]})
+
+
+@app.post("/sentiments-prediction/batch", response_class=PredictionResponse)
+async def predict_sentiment_batch(
+    data: PredictionBatch,
+    username=Depends(scheduled_user),
+    scorer=Depends(selected_model),
+):
+    predictions, scores = await run_in_threadpool(score_reviews, data.reviews, scorer)
+    return PredictionResponse(
+        {
+            "predictions": [
+                {"prediction": prediction, "score": score}
+                for prediction, score in zip(predictions, scores)
+            ]
+        }
+    )
+
+
+def clean_reviews(reviews):
+    if len(reviews) == 1:
+        return [text_cleaning(reviews[0])]
+    return clean_batch(reviews).tolist()
+
+
+def score_reviews(reviews, scorer=None):
+    # clean and score a list of reviews with a single model call
+    if not reviews:
+        return [], []
+    cleaned_reviews = clean_reviews(reviews)
+    positives = score_cleaned(cleaned_reviews, scorer)
+    if scorer is None:
+        shadow_request(cleaned_reviews, positives)
+    return labels_and_scores(positives)
+
+
+def shadow_request(cleaned_reviews, positives):
+    # a sampled request of the default model, for the shadow's agreement
+    # rate: whatever answered it, cascade, cache or model
+    if shadow_scorer is not None:
+        shadow_scorer.offer(cleaned_reviews, primary_positives=positives)
+
+
+def labels_and_scores(positives):
+    predictions = [
+        "Positive" if positive > 0.5 else "Negative" for positive in positives
+    ]
+    scores = [round(max(positive, 1 - positive), 2) for positive in positives]
+    return predictions, scores
+
+
+def score_cleaned(cleaned_reviews, scorer=None, use_cascade=True):
+    # positive-class probabilities; identical reviews of a batch are scored once
+    texts, indices = inflight.unique(cleaned_reviews)
+    if scorer is not None:
+        positives = predict_positives(scorer, texts)
+    else:
+        positives = score_default(texts, use_cascade)
+    return [positives[i] for i in indices]
 
-    # Optionally, remove stop words
-    if remove_stop_words:
-        # load stopwords
-        stop_words = stopwords.words("english")
-        text = text.split()
-        text = [w for w in text if not w in stop_words]
-        text = " ".join(text)
 
-    return text
+def predict_positives(current_model, texts, shadow=None):
+    # the prediction cache answers what it can, one model call the rest
+    version = model_versions.get(current_model)
+    use_cache = prediction_cache is not None and version is not None
+    if use_cache:
+        positives = prediction_cache.get_many(version, texts)
+    else:
+        positives = [None] * len(texts)
+    missing = [i for i, positive in enumerate(positives) if positive is None]
+    if not missing:
+        return positives
+
+    missing_texts = [texts[i] for i in missing]
+    start = time.perf_counter()
+    probas = current_model.predict_proba(missing_texts)
+    seconds = time.perf_counter() - start
+    if shadow is not None:
+        shadow.offer(missing_texts, primary_seconds=seconds)
+    scored = probas[:, 1].tolist()
+    if use_cache:
+        prediction_cache.put_many(version, missing_texts, scored)
+    for i, positive in zip(missing, scored):
+        positives[i] = positive
+    return positives
+
+
+async def score_review(review, scorer=None):
+    # one review from the event loop: the cascade answers inline, the model
+    # runs in the threadpool and identical concurrent reviews share its call
+    cleaned_review = text_cleaning(review)
+    positive = None
+    if scorer is None and cascade is not None:
+        positive = cascade.score(cleaned_review)
+    if positive is None and not COALESCE_REQUESTS:
+        positive = score_cleaned([cleaned_review], scorer, use_cascade=False)[0]
+    elif positive is None:
+        key = (id(model if scorer is None else scorer), cleaned_review)
+        positives = await inflight.run(
+            key, run_in_threadpool, score_cleaned, [cleaned_review], scorer, False
+        )
+        positive = positives[0]
+    if scorer is None:
+        shadow_request([cleaned_review], [positive])
+    return positive
+
+
+def score_default(cleaned_reviews, use_cascade=True):
+    # positive probabilities from the cascade where it is confident, from
+    # the default model (its cache and its shadow) for the rest
+    current_cascade, current_model = cascade, model
+    if current_cascade is None or not use_cascade:
+        positives = [None] * len(cleaned_reviews)
+    else:
+        positives = [current_cascade.score(text) for text in cleaned_reviews]
+    pending = [i for i, positive in enumerate(positives) if positive is None]
+    if not pending:
+        return positives
+
+    # model calls are timed against the shadow, except the warm-up's
+    shadow = shadow_scorer if warmup_report is not None else None
+    scored = predict_positives(
+        current_model, [cleaned_reviews[i] for i in pending], shadow=shadow
+    )
+    for i, positive in zip(pending, scored):
+        positives[i] = positive
+    return positives
+
+
+@app.post("/sentiments-prediction/stream")
+async def predict_sentiment_stream(
+    request: Request,
+    username: str = Depends(rate_limited_user),
+    scorer=Depends(selected_model),
+):
+    # score NDJSON records in micro-batches as they arrive and stream the
+    # results back as NDJSON, in the same order
+    async def results():
+        try:
+            async for batch in ndjson_batches(request.stream()):
+                valid = [record for record in batch if "error" not in record]
+                predictions, scores = await run_in_threadpool(
+                    score_reviews, [record["review"] for record in valid], scorer
+                )
+                scored = iter(zip(predictions, scores))
+                output = []
+                for record in batch:
+                    if "error" in record:
+                        output.append(record)
+                        continue
+                    prediction, score = next(scored)
+                    result = {"prediction": prediction, "score": score}
+                    if "id" in record:
+                        result["id"] = record["id"]
+                    output.append(result)
+                yield dump_results(output)
+        except ValueError as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+        except StarletteHTTPException as e:
+            # also raised while reading the body by RequestDecompressionMiddleware
+            # (413, invalid gzip), which does not use FastAPI's subclass
+            yield json.dumps({"error": e.detail}) + "\n"
+
+    return NDJSONStreamingResponse(results())
+
+
+scoring_jobs = ScoringJobs(score_reviews)
+
+
+@app.post("/jobs", status_code=status.HTTP_202_ACCEPTED)
+def create_scoring_job(
+    file: UploadFile = File(...), username: str = Depends(rate_limited_user)
+):
+    job_id = scoring_jobs.submit(file.file, owner=username)
+    return {"job_id": job_id}
+
+
+@app.get("/jobs/{job_id}")
+def get_scoring_job(job_id: str, username: str = Depends(get_current_user)):
+    job = scoring_jobs.status(job_id, owner=username)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Job not found"
+        )
+    return job
 
 
-@app.post("/sentiments-prediction")
-async def predict_sentiment(review: str, cleaned_review=Depends(get_current_user)):
-    # clean the review
-    cleaned_review = text_cleaning(review)
+@app.get("/jobs/{job_id}/result")
+def download_scoring_job(job_id: str, username: str = Depends(get_current_user)):
+    job = scoring_jobs.status(job_id, owner=username)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Job not found"
+        )
+    if job["status"] != "done":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Job is {}".format(job["status"]),
+        )
+    return FileResponse(
+        scoring_jobs.result_path(job_id),
+        media_type="text/csv",
+        filename="{}-scored.csv".format(job_id),
+    )
+
+
+@app.post("/feedback", status_code=status.HTTP_202_ACCEPTED)
+async def submit_feedback(
+    data: FeedbackBatch, username: str = Depends(get_current_admin)
+):
+    if online_learner is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Online learning is disabled or not supported by the served model",
+        )
+    cleaned_reviews = await run_in_threadpool(
+        clean_reviews, [item.review for item in data.feedback]
+    )
+    labels = [int(item.label == "Positive") for item in data.feedback]
+    if not online_learner.submit(cleaned_reviews, labels):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Feedback queue is full",
+        )
+    return {"queued": len(labels)}
 
-    #  prediction
-    analyse = int(model.predict([[cleaned_review]][0]))
-    score = model.predict_proba([[cleaned_review]][0])
-    output_score = str(round(float(score[:, analyse]), 2))
 
-    # output
-    if analyse == 0:
-        analyse = "Negative"
-    else:
-        analyse = "Positive"
+@app.get("/feedback")
+def feedback_status(username: str = Depends(get_current_admin)):
+    if online_learner is None:
+        return {"enabled": False}
+    return {"enabled": True, **online_learner.stats()}
+
+
+@app.get("/models")
+def list_models(username: str = Depends(get_current_admin)):
+    # available models, load times, hit rate and memory of the loaded ones
+    return {
+        "default": MODEL_PATH,
+        "available": registry.available(),
+        **registry.stats(),
+    }
+
+
+@app.get("/shadow")
+def shadow_status(username: str = Depends(get_current_admin)):
+    # agreement and latency of the candidate against the default model
+    if shadow_scorer is None:
+        return {"enabled": False}
+    return {"enabled": True, "model": SHADOW_MODEL, **shadow_scorer.stats()}
+
+
+@app.get("/coalescing")
+def coalescing_status(username: str = Depends(get_current_admin)):
+    return inflight.stats()
 
-    return {"prediction": analyse, "score": output_score}
+
+@app.get("/cache")
+def cache_status(username: str = Depends(get_current_admin)):
+    # hits, size and lookup latency of the shared cache, as seen by this worker
+    if prediction_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **prediction_cache.stats()}
+
+
+@app.get("/admission")
+def admission_status(username: str = Depends(get_current_admin)):
+    # limit, queue, rejections and latency of this worker's admission control
+    return admission.stats()
+
+
+@app.get("/rate-limits")
+def rate_limit_status(username: str = Depends(get_current_admin)):
+    return {"buckets": rate_limiter.stats(), "fair_queue": fair_scheduler.stats()}
 
 
 @app.put("/users")
@@ -148,16 +630,16 @@ def delete_users(username: str, use=Depends(get_current_admin)):
     return {f"{username} successfully deleted"}
 
 
-# @app.post("/sentiments-prediction")
-# async def predict_sentiment(data: Prediction, cleaned_review=Depends(get_current_user)):
-#     cleaned_review = text_cleaning(data.review)
-
-#     analyse = int(model.predict([[cleaned_review]][0]))
-#     score = model.predict_proba([[cleaned_review]][0])
-#     output_score = str(round(float(score[:, analyse]), 2))
-
-#     if analyse == 0:
-#         analyse = "Negative"
-#     else:
-#         analyse = "Positive"
-#     return {"prediction": analyse, "probabilité": output_score}
+if __name__ == "__main__":
+    # bulk clients reuse connections: keep them open longer than uvicorn's 5s
+    # default. Both HTTP implementations answer pipelined HTTP/1.1 requests
+    # in order; httptools parses them faster when installed.
+    uvicorn.run(
+        "main:app",
+        host=os.environ.get("HOST", "0.0.0.0"),
+        port=int(os.environ.get("PORT", 8000)),
+        workers=WORKERS,
+        http=os.environ.get("HTTP_IMPLEMENTATION", "auto"),
+        timeout_keep_alive=int(os.environ.get("KEEP_ALIVE_TIMEOUT", 75)),
+        backlog=int(os.environ.get("BACKLOG", 2048)),
+    )
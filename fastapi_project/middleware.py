@@ -0,0 +1,173 @@
+"""ASGI middlewares shared by the API."""
+
+import base64
+import binascii
+import time
+import zlib
+
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+MAX_DECOMPRESSED_BYTES = 16 << 20
+COMPRESSION_MINIMUM_SIZE = 1024
+
+# wbits for zlib.decompressobj, per Content-Encoding
+DECOMPRESSION_WBITS = {
+    "gzip": 16 + zlib.MAX_WBITS,
+    "x-gzip": 16 + zlib.MAX_WBITS,
+    "deflate": zlib.MAX_WBITS,
+}
+
+
+class RequestDecompressionMiddleware:
+    """Transparently inflate gzip/deflate request bodies, chunk by chunk."""
+
+    def __init__(self, app, max_size=MAX_DECOMPRESSED_BYTES):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = Headers(scope=scope).get("content-encoding", "").strip().lower()
+        if encoding not in DECOMPRESSION_WBITS:
+            await self.app(scope, receive, send)
+            return
+
+        scope = dict(scope)
+        scope["headers"] = [
+            (key, value)
+            for key, value in scope["headers"]
+            if key not in (b"content-encoding", b"content-length")
+        ]
+        decompressor = zlib.decompressobj(DECOMPRESSION_WBITS[encoding])
+        received = 0
+
+        async def decompressed_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] != "http.request":
+                return message
+
+            remaining = self.max_size - received
+            try:
+                # never inflate more than the limit, whatever the ratio
+                body = decompressor.decompress(message.get("body", b""), remaining + 1)
+                if len(body) > remaining:
+                    raise HTTPException(413, "Decompressed request body too large")
+                if not message.get("more_body", False):
+                    body += decompressor.flush()
+            except zlib.error:
+                raise HTTPException(400, "Invalid {} request body".format(encoding))
+            received += len(body)
+            return {**message, "body": body}
+
+        await self.app(scope, decompressed_receive, send)
+
+
+class ResponseCompressionMiddleware:
+    """Compress large responses of selected routes.
+
+    Brotli is used when brotli-asgi is installed and the client accepts it,
+    gzip otherwise. Excluded paths (e.g. streaming routes, where buffering
+    would delay the first results) are passed through untouched.
+    """
+
+    def __init__(self, app, paths, exclude=(), minimum_size=COMPRESSION_MINIMUM_SIZE):
+        self.app = app
+        self.paths = tuple(paths)
+        self.exclude = tuple(exclude)
+        if BrotliMiddleware is not None:
+            self.compressed_app = BrotliMiddleware(
+                app, minimum_size=minimum_size, gzip_fallback=True
+            )
+        else:
+            self.compressed_app = GZipMiddleware(app, minimum_size=minimum_size)
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] == "http"
+            and scope["path"].startswith(self.paths)
+            and not scope["path"].startswith(self.exclude)
+        ):
+            await self.compressed_app(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+
+def basic_auth_user(headers):
+    # the username of a Basic Authorization header, unverified; None if absent
+    scheme, _, credentials = headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "basic":
+        return None
+    try:
+        decoded = base64.b64decode(credentials, validate=True).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+    return decoded.partition(":")[0]
+
+
+class AdmissionControlMiddleware:
+    """Admit requests to selected routes through an AdmissionController.
+
+    Requests that get no slot are answered 503 with a Retry-After header
+    before their body is read. Long-lived routes (streams) are excluded, their
+    duration says nothing about the load.
+
+    The password is only checked later by the route, so the share of each
+    user is taken from the claimed Basic-auth username; names not in `users`
+    (and requests without one) share a single anonymous allowance. A user
+    over their share is answered 429.
+    """
+
+    def __init__(self, app, controller, paths, exclude=(), users=()):
+        self.app = app
+        self.controller = controller
+        self.paths = tuple(paths)
+        self.exclude = tuple(exclude)
+        self.users = users
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or not scope["path"].startswith(self.paths)
+            or scope["path"].startswith(self.exclude)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        user = basic_auth_user(Headers(scope=scope))
+        if user not in self.users:
+            user = None
+        if not self.controller.has_share(user):
+            response = JSONResponse(
+                {"detail": "Too many concurrent requests"},
+                status_code=429,
+                headers={"Retry-After": str(self.controller.retry_after())},
+            )
+            await response(scope, receive, send)
+            return
+
+        if not await self.controller.acquire(user):
+            response = JSONResponse(
+                {"detail": "Server overloaded, retry later"},
+                status_code=503,
+                headers={"Retry-After": str(self.controller.retry_after())},
+            )
+            await response(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(time.perf_counter() - start, user)
@@ -0,0 +1,119 @@
+"""Online learning from labelled feedback.
+
+Corrected labels are queued and applied in batches with partial_fit on a
+copy of the classifier; the updated pipeline then replaces the served one
+with a single assignment, so scoring never waits for learning. The fitted
+vectorizer is shared, not copied: a HashingVectorizer (sentiment_analysis.py
+--hashing) also learns from words never seen in training, a TfidfVectorizer
+only from the words of its training vocabulary.
+
+Updates are made in the memory of one process and are not shared: serve
+with a single uvicorn worker (main.py refuses to start otherwise).
+"""
+
+import copy
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+
+import joblib
+from sklearn.pipeline import Pipeline
+
+FEEDBACK_BATCH_SIZE = int(os.environ.get("FEEDBACK_BATCH_SIZE", 256))
+FEEDBACK_INTERVAL = float(os.environ.get("FEEDBACK_INTERVAL", 30))
+MAX_FEEDBACK_QUEUE = int(os.environ.get("MAX_FEEDBACK_QUEUE", 10_000))
+
+
+def supports_online_learning(model):
+    return isinstance(model, Pipeline) and hasattr(model.steps[-1][1], "partial_fit")
+
+
+class OnlineLearner:
+    def __init__(
+        self,
+        model,
+        on_update,
+        batch_size=FEEDBACK_BATCH_SIZE,
+        interval=FEEDBACK_INTERVAL,
+        max_queue=MAX_FEEDBACK_QUEUE,
+        save_path=None,
+    ):
+        # on_update(model) publishes each updated pipeline; save_path keeps
+        # the latest one on disk so a restart does not lose the feedback
+        if not supports_online_learning(model):
+            raise TypeError(
+                "online learning needs a sklearn pipeline ending with partial_fit"
+            )
+        self.model = model
+        self.on_update = on_update
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_queue = max_queue
+        self.save_path = save_path
+        self.updates = 0
+        self.learned = 0
+        self.last_update = None
+        self.last_error = None
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        threading.Thread(target=self._run, name="online-learner", daemon=True).start()
+
+    def submit(self, texts, labels):
+        # queue cleaned reviews and their labels; False when the queue is full
+        with self._lock:
+            if len(self._pending) + len(texts) > self.max_queue:
+                return False
+            self._pending.extend(zip(texts, labels))
+            if len(self._pending) >= self.batch_size:
+                self._ready.set()
+        return True
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "updates": self.updates,
+            "learned": self.learned,
+            "last_update": self.last_update,
+            "last_error": self.last_error,
+        }
+
+    def _run(self):
+        while True:
+            self._ready.wait(self.interval)
+            self._ready.clear()
+            with self._lock:
+                batch = list(self._pending)
+                self._pending.clear()
+            if not batch:
+                continue
+            texts, labels = zip(*batch)
+            try:
+                self.update(list(texts), list(labels))
+            except Exception as e:
+                self.last_error = repr(e)
+
+    def update(self, texts, labels):
+        # only the classifier changes: copy it, fit the copy, swap the pipeline
+        name, classifier = self.model.steps[-1]
+        classifier = copy.deepcopy(classifier)
+        classifier.partial_fit(self.model[:-1].transform(texts), labels)
+        model = Pipeline(self.model.steps[:-1] + [(name, classifier)])
+
+        if self.save_path:
+            directory = os.path.dirname(os.path.abspath(self.save_path))
+            with tempfile.NamedTemporaryFile(
+                dir=directory, suffix=".part", delete=False
+            ) as f:
+                joblib.dump(model, f)
+            os.replace(f.name, self.save_path)
+
+        self.model = model
+        self.on_update(model)
+        self.updates += 1
+        self.learned += len(texts)
+        self.last_update = time.time()
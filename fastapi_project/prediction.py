@@ -1,5 +1,38 @@
-from pydantic import BaseModel
+from typing import Literal
+
+from pydantic import BaseModel, conlist, constr
+
+MAX_REVIEW_LENGTH = 5000
+MAX_BATCH_SIZE = 1000
+
+# strict: no coercion, only a length check on an already decoded string
+Review = constr(strict=True, max_length=MAX_REVIEW_LENGTH)
 
 
 class Prediction(BaseModel):
-    review: str
+    review: Review
+
+    class Config:
+        extra = "forbid"
+
+
+class PredictionBatch(BaseModel):
+    reviews: conlist(Review, min_items=1, max_items=MAX_BATCH_SIZE)
+
+    class Config:
+        extra = "forbid"
+
+
+class Feedback(BaseModel):
+    review: Review
+    label: Literal["Positive", "Negative"]
+
+    class Config:
+        extra = "forbid"
+
+
+class FeedbackBatch(BaseModel):
+    feedback: conlist(Feedback, min_items=1, max_items=MAX_BATCH_SIZE)
+
+    class Config:
+        extra = "forbid"
@@ -0,0 +1,117 @@
+"""Text cleaning shared by training (sentiment_analysis.py) and serving (main.py).
+
+Both sides must clean reviews the same way, lemmatization included. WordNet
+lookups are slow, so lemmas come from a table precomputed on the training
+vocabulary, with a bounded memo for words the table does not know.
+"""
+
+import json
+import re
+from functools import lru_cache
+
+import pandas as pd
+from nltk.corpus import stopwords
+from nltk.stem import WordNetLemmatizer
+
+LEMMA_CACHE_SIZE = 100_000
+
+
+@lru_cache(maxsize=None)
+def get_stop_words():
+    return frozenset(stopwords.words("english"))
+
+
+class Lemmatizer:
+    def __init__(self, table=None, cache_size=LEMMA_CACHE_SIZE):
+        self.table = table or {}
+        self._wordnet = None
+        self._memo = lru_cache(maxsize=cache_size)(self._wordnet_lemmatize)
+
+    def _wordnet_lemmatize(self, word):
+        if self._wordnet is None:
+            self._wordnet = WordNetLemmatizer()
+        return self._wordnet.lemmatize(word)
+
+    def lemmatize(self, word):
+        lemma = self.table.get(word)
+        if lemma is None:
+            lemma = self._memo(word)
+        return lemma
+
+    def build(self, texts):
+        # one WordNet lookup per distinct word of the (cleaned) training texts
+        vocabulary = set()
+        for text in texts:
+            vocabulary.update(text.split())
+        self.table = {word: self._wordnet_lemmatize(word) for word in vocabulary}
+        return self.table
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.table, f)
+
+    def load(self, path):
+        with open(path) as f:
+            self.table = json.load(f)
+        self._memo.cache_clear()
+
+
+lemmatizer = Lemmatizer()
+
+
+def text_cleaning(text, remove_stop_words=True, lemmatize_words=True):
+    # Clean the text, with the option to remove stop_words and to lemmatize word
+    text = re.sub(r"[^A-Za-z0-9]", " ", text)
+    text = re.sub(r"\'s", " ", text)
+    text = re.sub(r"http\S+", " link ", text)
+    text = re.sub(r"\b\d+(?:\.\d+)?\s+", "", text)  # remove numbers
+
+    words = text.split()
+
+    # Optionally, remove stop words
+    if remove_stop_words:
+        stop_words = get_stop_words()
+        words = [w for w in words if w not in stop_words]
+
+    # Optionally, shorten words to their root
+    if lemmatize_words:
+        words = [lemmatizer.lemmatize(w) for w in words]
+
+    return " ".join(words)
+
+
+# byte table for clean_batch: ASCII letters and digits are kept, the review
+# separator (0xff never occurs in UTF-8) is kept, everything else is a space
+_BATCH_SEPARATOR = b"\xff"
+_ALNUM_TABLE = bytes(
+    c if chr(c).isascii() and chr(c).isalnum() or c == 0xFF else 0x20
+    for c in range(256)
+)
+
+
+def clean_batch(texts, remove_stop_words=True, lemmatize_words=True):
+    # Same output as text_cleaning, for a whole array of reviews at once.
+    # The reviews are joined into one byte buffer so that each substitution
+    # runs once over the array instead of once per review, and each distinct
+    # word is filtered and lemmatized once. Within a review, only ASCII
+    # letters, digits and spaces survive the first step, which is what the
+    # regexes below rely on; the space count does not matter after split().
+    texts = pd.Series(texts, dtype=object)
+    if texts.empty:
+        return texts
+    buffer = _BATCH_SEPARATOR.join(text.encode() for text in texts.fillna(""))
+    buffer = buffer.translate(_ALNUM_TABLE)
+    buffer = re.sub(rb"http[A-Za-z0-9]+", b" link ", buffer)
+    buffer = re.sub(rb"(?<![A-Za-z0-9])[0-9]+ +", b"", buffer)  # remove numbers
+    lines = buffer.decode("latin-1").split("\xff")
+
+    # stop words map to "" and are filtered out
+    stop_words = get_stop_words() if remove_stop_words else frozenset()
+    lemmatize = lemmatizer.lemmatize if lemmatize_words else str
+    words = {
+        w: "" if w in stop_words else lemmatize(w) for w in set(" ".join(lines).split())
+    }
+    cleaned = [
+        " ".join(filter(None, map(words.__getitem__, line.split()))) for line in lines
+    ]
+    return pd.Series(cleaned, index=texts.index, dtype=object)
@@ -0,0 +1,91 @@
+"""Per-stage wall time, CPU time and peak memory of a script run, and the
+latency summaries reported by the API's stats endpoints."""
+
+import os
+import resource
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+
+SAMPLE_INTERVAL = 0.005
+# latency summaries cover the last calls only
+LATENCY_WINDOW = 10_000
+
+
+def latency_summary(seconds):
+    # mean, p50 and p99 in ms of a list of durations in seconds
+    if len(seconds) < 2:
+        return None
+    cuts = statistics.quantiles(seconds, n=100)
+    return {
+        "mean": round(statistics.fmean(seconds) * 1000, 4),
+        "p50": round(cuts[49] * 1000, 4),
+        "p99": round(cuts[98] * 1000, 4),
+    }
+
+
+def current_rss():
+    # resident set size in bytes; /proc is cheap to read, unlike tracemalloc
+    # which slows allocation-heavy stages down several times
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _PeakSampler(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = current_rss()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(SAMPLE_INTERVAL):
+            self.peak = max(self.peak, current_rss())
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        self.peak = max(self.peak, current_rss())
+        return self.peak
+
+
+class StageProfiler:
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        # CPU time only covers this process, not joblib worker processes
+        sampler = _PeakSampler()
+        start_rss = sampler.peak
+        sampler.start()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            peak = sampler.stop()
+            self.stages.append(
+                {
+                    "stage": name,
+                    "wall_s": round(time.perf_counter() - wall, 3),
+                    "cpu_s": round(time.process_time() - cpu, 3),
+                    "peak_rss_mb": round(peak / 2**20, 1),
+                    "peak_growth_mb": round((peak - start_rss) / 2**20, 1),
+                }
+            )
+            print(
+                "[{stage}] wall {wall_s}s, cpu {cpu_s}s, "
+                "peak RSS {peak_rss_mb} MB".format(**self.stages[-1])
+            )
+
+    def skip(self, name):
+        self.stages.append({"stage": name, "skipped": True})
+
+    def report(self):
+        return {
+            "stages": self.stages,
+            "total_wall_s": round(sum(s.get("wall_s", 0) for s in self.stages), 3),
+        }
@@ -0,0 +1,145 @@
+"""Per-user rate limits and fair scheduling of inference.
+
+Each user has a token bucket (rate_limit requests per second, up to burst
+at once); a request finding it empty is rejected with 429. Admitted
+requests then take one of FAIR_MAX_IN_FLIGHT inference slots. When none is
+free they wait in a weighted fair queue: every request gets a virtual
+finish tag, max(virtual time, the user's previous tag) + 1 / weight, and
+slots go to the smallest tag. A heavy user's backlog therefore only delays
+that user's own requests, and a user of weight 2 gets twice the slots of a
+user of weight 1 when both are busy. Users coming back after an idle
+period start at the current virtual time, with no saved-up credit.
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+
+USER_RATE_LIMIT = float(os.environ.get("USER_RATE_LIMIT", 20))
+USER_BURST = float(os.environ.get("USER_BURST", 40))
+USER_WEIGHT = float(os.environ.get("USER_WEIGHT", 1))
+FAIR_MAX_IN_FLIGHT = int(os.environ.get("FAIR_MAX_IN_FLIGHT", 8))
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def consume(self):
+        # 0 if a token was taken, else the seconds until the next one
+        if self.refill() >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    def __init__(self):
+        self._buckets = {}
+        self.allowed = {}
+        self.limited = {}
+
+    def consume(self, user, rate, burst):
+        # rate None or 0: unlimited; a changed limit starts a fresh bucket
+        if not rate:
+            return 0
+        bucket = self._buckets.get(user)
+        if bucket is None or (bucket.rate, bucket.burst) != (rate, burst):
+            bucket = self._buckets[user] = TokenBucket(rate, burst)
+        wait = bucket.consume()
+        counts = self.limited if wait else self.allowed
+        counts[user] = counts.get(user, 0) + 1
+        return wait
+
+    def stats(self):
+        return {
+            user: {
+                "rate_limit": bucket.rate,
+                "burst": bucket.burst,
+                "tokens": round(bucket.refill(), 2),
+                "allowed": self.allowed.get(user, 0),
+                "limited": self.limited.get(user, 0),
+            }
+            for user, bucket in self._buckets.items()
+        }
+
+
+class FairScheduler:
+    def __init__(self, max_in_flight=FAIR_MAX_IN_FLIGHT):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.virtual_time = 0.0
+        self._finish = {}  # user -> finish tag of their last request
+        self._queue = []  # heap of (tag, sequence, waiter)
+        self._sequence = itertools.count()
+        self.started = {}
+        self.queued = {}
+        self.wait_seconds = {}
+
+    @asynccontextmanager
+    async def slot(self, user, weight=1.0):
+        tag = max(self.virtual_time, self._finish.get(user, 0.0)) + 1 / weight
+        self._finish[user] = tag
+        # cancelled waiters stay in the heap until they come up
+        while self._queue and self._queue[0][2].done():
+            heapq.heappop(self._queue)
+        if self.in_flight < self.max_in_flight and not self._queue:
+            self.in_flight += 1
+            self.virtual_time = tag
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._queue, (tag, next(self._sequence), waiter))
+            self.queued[user] = self.queued.get(user, 0) + 1
+            start = time.perf_counter()
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # the client went away: pass on a slot handed over meanwhile
+                if waiter.done() and not waiter.cancelled():
+                    self._release()
+                else:
+                    waiter.cancel()
+                raise
+            waited = time.perf_counter() - start
+            self.wait_seconds[user] = self.wait_seconds.get(user, 0.0) + waited
+        self.started[user] = self.started.get(user, 0) + 1
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        self.in_flight -= 1
+        while self._queue and self.in_flight < self.max_in_flight:
+            tag, _, waiter = heapq.heappop(self._queue)
+            if not waiter.done():
+                self.in_flight += 1
+                self.virtual_time = tag
+                waiter.set_result(None)
+
+    def stats(self):
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "queue": sum(1 for _, _, waiter in self._queue if not waiter.done()),
+            "users": {
+                user: {
+                    "started": started,
+                    "queued": self.queued.get(user, 0),
+                    "wait_seconds": round(self.wait_seconds.get(user, 0.0), 3),
+                }
+                for user, started in self.started.items()
+            },
+        }
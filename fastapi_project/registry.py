@@ -0,0 +1,208 @@
+"""Registry of per-client sentiment models.
+
+Models live in versioned directories under MODELS_DIR:
+
+    models/<name>/<version>/   an artifact directory (manifest.json),
+                               or a model.onnx or model.pkl file
+
+A model is selected as "name" (its highest version) or "name:version". It is
+loaded on first use and kept in memory until the loaded models exceed
+MODEL_MEMORY_BUDGET_MB; the least recently used ones are evicted first.
+Requests already holding an evicted model finish with it.
+
+peek() answers for loaded models without touching the disk: the highest
+version of a name is remembered for MODEL_RESOLVE_TTL seconds, so a new
+version is picked up by "name" selectors after at most that long (or at
+once after refresh()).
+"""
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from backends import load_backend
+from profiling import current_rss
+
+MODELS_DIR = Path(os.environ.get("MODELS_DIR", "models"))
+MODEL_MEMORY_BUDGET_MB = float(os.environ.get("MODEL_MEMORY_BUDGET_MB", 1024))
+MODEL_RESOLVE_TTL = float(os.environ.get("MODEL_RESOLVE_TTL", 30))
+MODEL_FILES = ("model.onnx", "model.pkl")
+
+# no leading dot: "." and ".." would leave MODELS_DIR
+NAME_PATTERN = re.compile(r"[A-Za-z0-9_-][A-Za-z0-9_.-]*")
+
+
+def disk_size(path):
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.iterdir() if p.is_file())
+    return path.stat().st_size
+
+
+def version_key(version):
+    # 2 < 10, and numeric versions sort after named ones
+    return (version.isdigit(), int(version) if version.isdigit() else version)
+
+
+class ModelRegistry:
+    def __init__(
+        self,
+        models_dir=MODELS_DIR,
+        memory_budget_mb=MODEL_MEMORY_BUDGET_MB,
+        resolve_ttl=MODEL_RESOLVE_TTL,
+    ):
+        self.models_dir = Path(models_dir)
+        self.memory_budget = memory_budget_mb * 2**20
+        self.resolve_ttl = resolve_ttl
+        self._latest = {}  # name -> (highest version, monotonic expiry)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._loaded = OrderedDict()  # key -> (model, memory), least recent first
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def versions(self, name):
+        directory = self.models_dir / name
+        if not NAME_PATTERN.fullmatch(name) or not directory.is_dir():
+            return []
+        return sorted(
+            (
+                p.name
+                for p in directory.iterdir()
+                if p.is_dir() and NAME_PATTERN.fullmatch(p.name)
+            ),
+            key=version_key,
+        )
+
+    def available(self):
+        if not self.models_dir.is_dir():
+            return {}
+        return {
+            p.name: self.versions(p.name)
+            for p in sorted(self.models_dir.iterdir())
+            if p.is_dir() and self.versions(p.name)
+        }
+
+    def resolve(self, selector):
+        # "name" or "name:version" -> "name:version"; KeyError if unknown
+        name, _, version = selector.partition(":")
+        versions = self.versions(name)
+        if not version and versions:
+            version = versions[-1]
+        if version not in versions or not NAME_PATTERN.fullmatch(version):
+            raise KeyError(selector)
+        if versions:
+            with self._lock:
+                self._latest[name] = (
+                    versions[-1],
+                    time.monotonic() + self.resolve_ttl,
+                )
+        return f"{name}:{version}"
+
+    def refresh(self):
+        # forget the highest versions: the next "name" selectors re-read the disk
+        with self._lock:
+            self._latest.clear()
+
+    def model_path(self, key):
+        directory = self.models_dir.joinpath(*key.split(":"))
+        # a symlinked version directory must not point outside MODELS_DIR either
+        if self.models_dir.resolve() not in directory.resolve().parents:
+            raise KeyError(key)
+        if (directory / "manifest.json").exists():
+            return directory
+        for filename in MODEL_FILES:
+            if (directory / filename).exists():
+                return directory / filename
+        raise KeyError(key)
+
+    def get(self, selector):
+        key = self.resolve(selector)
+        with self._lock:
+            cached = self._hit(key)
+        if cached is not None:
+            return cached
+
+        # one load at a time: no model is loaded twice, and the RSS growth
+        # measured around a load belongs to that model
+        with self._load_lock:
+            with self._lock:
+                cached = self._hit(key)
+            if cached is not None:
+                return cached
+            path = self.model_path(key)
+            rss, start = current_rss(), time.perf_counter()
+            model = load_backend(path)
+            seconds = time.perf_counter() - start
+            growth = current_rss() - rss
+
+        with self._lock:
+            self.misses += 1
+            stats = self._stats.setdefault(key, {"hits": 0, "loads": 0, "memory": 0})
+            # RSS does not shrink when a model is evicted, so a reload can
+            # measure no growth at all: keep the largest estimate, at least
+            # the size on disk (the mapped arrays of an artifact)
+            stats["memory"] = max(stats["memory"], growth, disk_size(path))
+            stats["loads"] += 1
+            stats["load_seconds"] = round(seconds, 4)
+            self._loaded[key] = (model, stats["memory"])
+            self._evict(keep=key)
+        return model
+
+    def peek(self, selector):
+        # the model if it is already loaded, else None; never touches the disk
+        # (only resolved keys are ever loaded, so no selector is validated here)
+        name, _, version = selector.partition(":")
+        with self._lock:
+            if not version:
+                latest = self._latest.get(name)
+                if latest is None or latest[1] < time.monotonic():
+                    return None
+                version = latest[0]
+            return self._hit(f"{name}:{version}")
+
+    def _hit(self, key):
+        entry = self._loaded.get(key)
+        if entry is None:
+            return None
+        self._loaded.move_to_end(key)
+        self.hits += 1
+        self._stats[key]["hits"] += 1
+        return entry[0]
+
+    def _evict(self, keep):
+        used = sum(memory for _, memory in self._loaded.values())
+        for key in list(self._loaded):
+            if used <= self.memory_budget:
+                break
+            if key != keep:
+                used -= self._loaded.pop(key)[1]
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / requests, 4) if requests else None,
+                "evictions": self.evictions,
+                "memory_mb": round(
+                    sum(m for _, m in self._loaded.values()) / 2**20, 2
+                ),
+                "memory_budget_mb": round(self.memory_budget / 2**20, 2),
+                "models": {
+                    key: {
+                        "hits": stats["hits"],
+                        "loads": stats["loads"],
+                        "load_seconds": stats["load_seconds"],
+                        "memory_mb": round(stats["memory"] / 2**20, 2),
+                        "loaded": key in self._loaded,
+                    }
+                    for key, stats in self._stats.items()
+                },
+            }
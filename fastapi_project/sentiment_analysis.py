@@ -2,26 +2,90 @@
 Afficher les 10 premières lignes du dataset."""
 
 
-import re
+import argparse
+import json
+import shutil
+import tempfile
+from pathlib import Path
 
 import matplotlib.pyplot as plt
 import nltk
 import numpy as np
 import pandas as pd
+import joblib
 import seaborn as sns
 from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
 from sklearn.feature_extraction.text import (
     CountVectorizer,
-    TfidfTransformer,
+    HashingVectorizer,
     TfidfVectorizer,
 )
 from sklearn.metrics import accuracy_score, classification_report
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import GridSearchCV, train_test_split
 from sklearn.naive_bayes import MultinomialNB  # l'algorithme Naive Byes
 from sklearn.pipeline import Pipeline
 from wordcloud import WordCloud
 
+from artifact import compare_models, export_model, load_model
+from backends import OnnxModel, export_onnx
+from dataset import read_dataset
+from dedupe import deduplicate
+from preprocessing import clean_batch, lemmatizer
+from profiling import StageProfiler
+from wordfreq import word_frequencies
+
+parser = argparse.ArgumentParser(
+    description="Entraîner le modèle d'analyse des sentiments"
+)
+parser.add_argument(
+    "--search",
+    action="store_true",
+    help="chercher les meilleurs paramètres du vectorizer et de alpha "
+    "(validation croisée)",
+)
+parser.add_argument(
+    "--n-jobs", type=int, default=-1, help="nombre de process pour --search"
+)
+parser.add_argument(
+    "--headless",
+    action="store_true",
+    help="sans graphiques ni exploration des données (serveur, CI)",
+)
+parser.add_argument(
+    "--export-dtype",
+    choices=["float64", "float32"],
+    default="float64",
+    help="précision des paramètres du modèle exporté dans data/model",
+)
+parser.add_argument(
+    "--onnx",
+    action="store_true",
+    help="exporter aussi le modèle au format ONNX (data/model.onnx, demande skl2onnx)",
+)
+parser.add_argument(
+    "--hashing",
+    action="store_true",
+    help="HashingVectorizer sans vocabulaire, pour l'apprentissage en ligne "
+    "(POST /feedback); seul data/modele.pkl est sauvegardé",
+)
+args = parser.parse_args()
+if args.hashing and args.onnx:
+    parser.error("--onnx ne supporte pas --hashing")
+
+# grille de la recherche: le vectorizer ajusté est mis en cache (Pipeline memory=)
+# et réutilisé pour toutes les valeurs de alpha d'un même fold
+PARAM_GRID = {
+    "tfidf__ngram_range": [(1, 1), (1, 2)],
+    "tfidf__min_df": [1, 2, 5],
+    "tfidf__sublinear_tf": [False, True],
+    "classifier__alpha": [0.01, 0.1, 0.5, 1.0],
+}
+# avec --hashing: pas de vocabulaire, donc pas de min_df
+HASHING_PARAM_GRID = {
+    "hashing__ngram_range": [(1, 1), (1, 2)],
+    "classifier__alpha": [0.01, 0.1, 0.5, 1.0],
+}
+
 for dependency in (
     "stopwords",
     "wordnet",
@@ -29,111 +93,103 @@ for dependency in (
 ):
     nltk.download(dependency)
 
-# df = pd.read_csv("data/02-cashnet.csv")
-
-# df["sentiment"] = df.loc[:, "stars"]
-
-
-# df["sentiment"].replace(1, 0, inplace=True)
-# df["sentiment"].replace(2, 0, inplace=True)
-
-# df["sentiment"].replace(3, 1, inplace=True)
-# df["sentiment"].replace(4, 1, inplace=True)
-# df["sentiment"].replace(5, 1, inplace=True)
+# les labels sentiment (1-2 étoiles: 0, 3-5 étoiles: 1) sont dérivés de l'export
+# brut par python derive_labels.py data/02-cashnet.csv data/new-cashnet.csv
 
-# df.dropna(axis=0, how="any", inplace=True)
-# df.head()
+# chaque étape est chronométrée (temps réel, CPU, mémoire) et le rapport est écrit
+# avec le modèle; en mode --headless les étapes d'exploration et les graphiques
+# sont sautées
+profiler = StageProfiler()
+if args.headless:
+    plt.switch_backend("Agg")
 
-# df.to_csv("data/new-cashnet.csv", index=False)
+# importer les données: le format colonnes mappé en mémoire s'il a été généré
+# (python dataset.py data/new-cashnet.csv data/new-cashnet), sinon le CSV
+with profiler.stage("load"):
+    DATASET_PATH = "data/new-cashnet"
+    if not Path(DATASET_PATH).is_dir():
+        DATASET_PATH = "data/new-cashnet.csv"
+    dataset = read_dataset(DATASET_PATH, columns=["reviews", "sentiment"])
 
+    # Afficher les 10 premières lignes
+    dataset.head()
 
-# importer les données
-dataset = pd.read_csv("data/new-cashnet.csv")
-
-# Afficher les 10 premières lignes
-dataset.head()
-
-# trouver le shape de dataset
-dataset.shape
-# verifier s'il ya des valeurs null
-dataset.isnull().sum()
-
-# ------------------------------------------------------------------------------------------------------------------------------
-# drop les columns Title,stars
-dataset = dataset[["reviews", "sentiment"]]
-
-# Évaluer la distribution de classe stars
-data = dataset["sentiment"].value_counts()
-
-# créer une visualisation
-sns.barplot(x=data.index, y=data.values)
-
-# ------------------------------------------------------------------------------------------------------------------------------
-# Compilez tous les commentaires du column reviewsdans une variable texte
-txt = ""
-for i in dataset.reviews:
-    txt += i
-print(txt)
+    # trouver le shape de dataset
+    dataset.shape
+    # verifier s'il ya des valeurs null
+    dataset.isnull().sum()
 
+    # drop les columns Title,stars
+    dataset = dataset[["reviews", "sentiment"]]
 
 # Initialiser une variable stop_words contenant des mots vides en anglais.
 
 stop_words = set(stopwords.words("english"))
-print(stop_words)
 
 # ------------------------------------------------------------------------------------------------------------------------------
-# générer un word cloud
-from wordcloud import WordCloud
+if args.headless:
+    profiler.skip("class_distribution_plot")
+    profiler.skip("word_cloud")
+else:
+    with profiler.stage("class_distribution_plot"):
+        # Évaluer la distribution de classe stars
+        data = dataset["sentiment"].value_counts()
+
+        # créer une visualisation
+        sns.barplot(x=data.index, y=data.values)
+
+    # ------------------------------------------------------------------------------------------------------------------------------
+    with profiler.stage("word_cloud"):
+        # Compter les mots des reviews par morceaux (global et par classe), sans
+        # construire un seul grand texte; les fréquences sont mises en cache à côté
+        # des données
+        print(stop_words)
+        frequencies = word_frequencies(
+            DATASET_PATH, stop_words, cache_path="data/word_frequencies.json"
+        )
+
+        # générer un word cloud
+        wc = WordCloud(
+            background_color="black",
+            max_words=300,
+            stopwords=stop_words,
+            max_font_size=50,
+            random_state=42,
+        )
+
+        """afficher le wordcloud, pour toutes les reviews puis pour chaque classe"""
+
+        for label, label_frequencies in frequencies.items():
+            plt.figure(figsize=(15, 15))  # Figure initialization
+            wc.generate_from_frequencies(
+                label_frequencies
+            )  # "Calculation" from the wordcloud
+            plt.imshow(wc)  # Display
+            plt.title("sentiment: {}".format(label))
+            plt.show()
 
-wc = WordCloud(
-    background_color="black",
-    max_words=300,
-    stopwords=stop_words,
-    max_font_size=50,
-    random_state=42,
-)
-
-"""afficher le wordcloud"""
+# ------------------------------------------------------------------------------------------------------------------------------
+# supprimer les reviews en double (texte normalisé et même label) avant de diviser
+# les données et de les nettoyer, pour qu'une même review ne se retrouve pas à la
+# fois dans le train et le test ; un même texte sous les deux labels est gardé
+# (sinon le premier label gagne) et compté dans label_conflicts
+with profiler.stage("dedupe"):
+    dataset, dedupe_stats = deduplicate(dataset, column="reviews", label="sentiment")
+    print(dedupe_stats)
 
-import matplotlib.pyplot as plt
+training_report = {"dedupe": dedupe_stats}
 
-plt.figure(figsize=(15, 15))  # Figure initialization
-wc.generate(txt)  # "Calculation" from the wordcloud
-plt.imshow(wc)  # Display
-plt.show()
 # ------------------------------------------------------------------------------------------------------------------------------
-def text_cleaning(text, remove_stop_words=True, lemmatize_words=True):
-    # Nettoyer le texte, avec la possibilité de supprimer les stop_words et de lemmatiser le mot
-    # Nettoyer le texte
-    text = re.sub(r"[^A-Za-z0-9]", " ", text)
-    text = re.sub(r"\'s", " ", text)
-    text = re.sub(r"http\S+", " link ", text)
-    text = re.sub(r"\b\d+(?:\.\d+)?\s+", "", text)  # remove numbers
-
-    # Supprimer la ponctuation du texte
-    # text = "".join([c for c in text if c not in punctuation])
-
-    # Optionnelle, supprimez les mots vides
-    if remove_stop_words:
-        text = text.split()
-        text = [w for w in text if not w in stop_words]
-        text = " ".join(text)
-
-    # Optionnelle, raccourcir les mots à leurs racine
-    if lemmatize_words:
-        text = text.split()
-        lemmatizer = WordNetLemmatizer()
-        lemmatized_words = [lemmatizer.lemmatize(word) for word in text]
-        text = " ".join(lemmatized_words)
-
-    # Return a list of words
-    return text
-
-
-# nltk.download('wordnet')
-# nltk.download('omw-1.4')
-# appliquer la fonction text cleaning
-dataset["cleaned_review"] = dataset["reviews"].apply(text_cleaning)
+with profiler.stage("cleaning"):
+    # nettoyer les reviews sans lemmatiser, puis précalculer la table des lemmes
+    # du vocabulaire d'entraînement, réutilisée par main.py au moment de servir
+    dataset["cleaned_review"] = clean_batch(dataset["reviews"], lemmatize_words=False)
+    lemmatizer.build(dataset["cleaned_review"])
+    lemmatizer.save("data/lemmas.json")
+
+    # appliquer le nettoyage à toutes les reviews d'un coup (même résultat que
+    # text_cleaning)
+    dataset["cleaned_review"] = clean_batch(dataset["reviews"])
 
 # ------------------------------------------------------------------------------------------------------------------------------
 #  créer les variables (features et target)
@@ -149,41 +205,118 @@ X_train, X_test, y_train, y_test = train_test_split(
 )
 
 
+cache_dir = tempfile.mkdtemp() if args.search else None
+if args.hashing:
+    # sans état: les mots nouveaux des feedbacks sont pris en compte par partial_fit
+    # (alternate_sign=False: MultinomialNB demande des valeurs positives)
+    vectorizer = (
+        "hashing",
+        HashingVectorizer(n_features=2**20, alternate_sign=False),
+    )
+    param_grid = HASHING_PARAM_GRID
+else:
+    vectorizer = ("tfidf", TfidfVectorizer())
+    param_grid = PARAM_GRID
 pipeline = Pipeline(
     [
-        ("tfidf", TfidfTransformer()),
+        vectorizer,
         ("classifier", MultinomialNB()),
-    ]
+    ],
+    memory=cache_dir,
 )
 
-modele = pipeline.fit(X_train, y_train)
-
-y_pred = modele.predict(X_test)
+if args.search:
+    with profiler.stage("search"):
+        # les folds et les paramètres sont répartis sur tous les coeurs
+        search = GridSearchCV(pipeline, param_grid, cv=5, n_jobs=args.n_jobs, verbose=1)
+        search.fit(X_train, y_train)
+
+    results = pd.DataFrame(search.cv_results_).sort_values("rank_test_score")
+    results.to_csv("data/search_results.csv", index=False)
+    print(
+        results[["params", "mean_test_score", "std_test_score", "mean_fit_time"]].head(
+            10
+        )
+    )
+
+    modele = search.best_estimator_.set_params(memory=None)
+    training_report["search"] = {
+        "best_params": {k: str(v) for k, v in search.best_params_.items()},
+        "best_cv_accuracy": search.best_score_,
+        "candidates": len(results),
+    }
+    shutil.rmtree(cache_dir)
+else:
+    with profiler.stage("fit"):
+        modele = pipeline.fit(X_train, y_train)
 
 # ------------------------------------------------------------------------------------------------------------------------------
-# Afficher le rapport de la classification
-from sklearn.metrics import classification_report
+with profiler.stage("evaluation"):
+    y_pred = modele.predict(X_test)
 
-print(classification_report(y_test, y_pred))
+    # Afficher le rapport de la classification
+    print(classification_report(y_test, y_pred))
 
+    print("Accuracy Train: {}".format(accuracy_score(y_test, y_pred)))
+    training_report["test_accuracy"] = accuracy_score(y_test, y_pred)
 
-print("Accuracy Train: {}".format(accuracy_score(y_test, y_pred)))
+    confusion_matrix = pd.crosstab(
+        y_test, y_pred, rownames=["Real Class"], colnames=["Predicted Class"]
+    )
+    print(confusion_matrix)
 
 # afficher la confusion matrix
+if args.headless:
+    profiler.skip("confusion_matrix_plot")
+else:
+    with profiler.stage("confusion_matrix_plot"):
+        import scikitplot as skplt
 
-import scikitplot as skplt
-
-skplt.metrics.plot_confusion_matrix(y_test, y_pred, normalize=True)
-plt.show()
-
-
-confusion_matrix = pd.crosstab(
-    y_test, y_pred, rownames=["Real Class"], colnames=["Predicted Class"]
-)
-print(confusion_matrix)
+        skplt.metrics.plot_confusion_matrix(y_test, y_pred, normalize=True)
+        plt.show()
 
 # ------------------------------------------------------------------------------------------------------------------------------
 # sauvgarder le model de la prediction
-import joblib
-
-joblib.dump(modele, "data/modele.pkl")
+with profiler.stage("save"):
+    joblib.dump(modele, "data/modele.pkl")
+
+    # et au format tableaux + manifest, chargé sans pickle par main.py
+    # (MODEL_PATH=model)
+    if not args.hashing:
+        training_report["artifact"] = export_model(
+            modele, "data/model", dtype=args.export_dtype
+        )["files"]
+
+    # et au format ONNX, servi par onnxruntime (MODEL_PATH=model.onnx)
+    if args.onnx:
+        export_onnx(modele, "data/model.onnx")
+
+# vérifier que les modèles exportés (float32 compris) prédisent comme le modèle
+# entraîné
+export_check = {"ok": True}
+if args.hashing:
+    profiler.skip("export_check")
+else:
+    with profiler.stage("export_check"):
+        export_check = compare_models(
+            modele, load_model("data/model"), dataset["cleaned_review"].tolist()
+        )
+        training_report["export_check"] = export_check
+        print(export_check)
+        if args.onnx:
+            onnx_check = compare_models(
+                modele, OnnxModel("data/model.onnx"), dataset["cleaned_review"].tolist()
+            )
+            training_report["onnx_check"] = onnx_check
+            print(onnx_check)
+            export_check = dict(
+                export_check, ok=export_check["ok"] and onnx_check["ok"]
+            )
+
+training_report.update(profiler.report())
+training_report["rows"] = len(dataset)
+with open("data/training_report.json", "w") as f:
+    json.dump(training_report, f, indent=2)
+
+if not export_check["ok"]:
+    raise SystemExit("le modèle exporté ne prédit pas comme le modèle entraîné")
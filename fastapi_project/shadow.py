@@ -0,0 +1,102 @@
+"""Shadow scoring of a candidate model on live traffic.
+
+Two kinds of samples are handed, already cleaned, to a worker thread that
+scores them again with the candidate:
+
+- requests, with the positive probabilities they were answered with,
+  whichever path answered them (cascade, prediction cache or model), for
+  the agreement rate;
+- calls of the default model, with their duration, for the latency
+  comparison.
+
+Requests only ever get the primary result. The hand-off never blocks: when
+the bounded queue is full the sample is dropped, and a failing candidate
+only counts errors. The worker still shares the GIL with the app, so keep
+the sample rate low enough for the spare CPU.
+"""
+
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from profiling import LATENCY_WINDOW, latency_summary
+
+SHADOW_SAMPLE_RATE = float(os.environ.get("SHADOW_SAMPLE_RATE", 0.05))
+SHADOW_QUEUE_SIZE = int(os.environ.get("SHADOW_QUEUE_SIZE", 64))
+
+
+class ShadowScorer:
+    def __init__(
+        self, candidate, sample_rate=SHADOW_SAMPLE_RATE, max_queue=SHADOW_QUEUE_SIZE
+    ):
+        self.candidate = candidate
+        self.sample_rate = sample_rate
+        self.offered = 0
+        self.dropped = 0
+        self.scored = 0
+        self.errors = 0
+        self.reviews = 0
+        self.agreed = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)  # (primary, shadow) seconds
+        self._queue = queue.Queue(maxsize=max_queue)
+        threading.Thread(target=self._run, name="shadow-scorer", daemon=True).start()
+
+    def offer(self, cleaned_reviews, primary_positives=None, primary_seconds=None):
+        # called on the request path: a coin flip and a non-blocking put.
+        # primary_positives: compare the labels; primary_seconds: the latency
+        if random.random() >= self.sample_rate:
+            return
+        self.offered += 1
+        try:
+            self._queue.put_nowait(
+                (cleaned_reviews, primary_positives, primary_seconds)
+            )
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            cleaned_reviews, primary_positives, primary_seconds = self._queue.get()
+            start = time.perf_counter()
+            try:
+                labels = self.candidate.predict_proba(cleaned_reviews).argmax(axis=1)
+            except Exception:
+                self.errors += 1
+                continue
+            seconds = time.perf_counter() - start
+            self.scored += 1
+            if primary_seconds is not None:
+                self._latencies.append((primary_seconds, seconds))
+            if primary_positives is not None:
+                primary_labels = np.asarray(primary_positives) > 0.5
+                self.reviews += len(labels)
+                self.agreed += int((labels == primary_labels).sum())
+
+    def stats(self):
+        latencies = list(self._latencies)
+        report = {
+            "sample_rate": self.sample_rate,
+            "offered": self.offered,
+            "dropped": self.dropped,
+            "pending": self._queue.qsize(),
+            "scored": self.scored,
+            "errors": self.errors,
+            "reviews": self.reviews,
+            "agreement": round(self.agreed / self.reviews, 4) if self.reviews else None,
+        }
+        if len(latencies) >= 2:
+            primary = [p for p, _ in latencies]
+            shadow = [s for _, s in latencies]
+            deltas = [s - p for p, s in latencies]
+            for name, values in (
+                ("primary", primary),
+                ("shadow", shadow),
+                ("delta", deltas),
+            ):
+                report[f"{name}_ms"] = latency_summary(values)
+        return report
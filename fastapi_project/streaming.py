@@ -0,0 +1,72 @@
+"""Helpers for the streaming NDJSON prediction endpoint."""
+
+import json
+
+from fastapi.responses import StreamingResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+NDJSON_BATCH_SIZE = 64
+MAX_LINE_BYTES = 1 << 20
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope, receive, send):
+        # StreamingResponse normally listens for a disconnect on receive(),
+        # which would steal the request body chunks the generator is reading
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+def parse_record(line):
+    # a record is either {"review": "...", "id": ...} or a bare JSON string
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return {"error": "invalid JSON"}
+    if isinstance(record, str):
+        return {"review": record}
+    if not isinstance(record, dict) or not isinstance(record.get("review"), str):
+        return {"error": "expected a 'review' string", "id": _record_id(record)}
+    return record
+
+
+def _record_id(record):
+    return record.get("id") if isinstance(record, dict) else None
+
+
+async def ndjson_batches(chunks, batch_size=NDJSON_BATCH_SIZE):
+    # group the records of a chunked body into micro-batches, without waiting
+    # for a full batch when the client has nothing more to send yet
+    buffer = b""
+    batch = []
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        if len(buffer) > MAX_LINE_BYTES:
+            raise ValueError("NDJSON line longer than {} bytes".format(MAX_LINE_BYTES))
+
+        for line in lines:
+            if line.strip():
+                batch.append(parse_record(line))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+            batch = []
+
+    if buffer.strip():
+        yield [parse_record(buffer)]
+
+
+def dump_results(results):
+    if orjson is not None:
+        return b"".join(orjson.dumps(result) + b"\n" for result in results)
+    return "".join(json.dumps(result) + "\n" for result in results)
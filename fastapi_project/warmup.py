@@ -0,0 +1,55 @@
+"""Warm-up of a worker before it reports ready.
+
+Right after a deploy the first requests pay for everything that is loaded
+lazily: the WordNet corpus and the lemma memo, the model's pages and code
+paths, and an empty prediction cache. warm_up runs a few single-review
+inferences, then scores the WARMUP_TOP_N most frequent cleaned reviews of a
+historical corpus (WARMUP_CORPUS, a CSV or columnar dataset with a reviews
+column) through the request path, which stores them in the prediction cache
+when one is configured.
+"""
+
+import os
+import time
+from collections import Counter
+
+from dataset import read_dataset_chunks
+from preprocessing import clean_batch, text_cleaning
+
+WARMUP_CORPUS = os.environ.get("WARMUP_CORPUS")
+WARMUP_TOP_N = int(os.environ.get("WARMUP_TOP_N", 10_000))
+WARMUP_CALLS = int(os.environ.get("WARMUP_CALLS", 50))
+WARMUP_BATCH_SIZE = 1000
+
+# a word outside the lemma table loads the WordNet corpus
+DUMMY_REVIEWS = [
+    "Highly recommend, fast and easy loan",
+    "Terrible customer service, hidden fees everywhere",
+    "warmup reviews with unlemmatizedwarmupwords",
+]
+
+
+def frequent_reviews(path, n, chunksize=100_000):
+    # the n most frequent cleaned reviews of the corpus, most frequent first
+    counts = Counter()
+    for chunk in read_dataset_chunks(path, columns=["reviews"], chunksize=chunksize):
+        counts.update(clean_batch(chunk["reviews"].dropna().astype(str)).tolist())
+    return [text for text, _ in counts.most_common(n)]
+
+
+def warm_up(
+    model, score_cleaned, corpus=WARMUP_CORPUS, top_n=WARMUP_TOP_N, calls=WARMUP_CALLS
+):
+    start = time.perf_counter()
+    for i in range(calls):
+        model.predict_proba([text_cleaning(DUMMY_REVIEWS[i % len(DUMMY_REVIEWS)])])
+    report = {"dummy_calls": calls}
+
+    if corpus:
+        texts = frequent_reviews(corpus, top_n)
+        for i in range(0, len(texts), WARMUP_BATCH_SIZE):
+            score_cleaned(texts[i : i + WARMUP_BATCH_SIZE])
+        report["corpus"] = corpus
+        report["reviews"] = len(texts)
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    return report
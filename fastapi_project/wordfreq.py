@@ -0,0 +1,74 @@
+"""Streaming word frequencies for the word cloud.
+
+Reviews are read chunk by chunk and only the counters are kept in memory,
+overall and per sentiment class. The result is cached next to the dataset
+and reused until the dataset changes: the CSV file, or for a columnar
+dataset directory its manifest.json and any of its column files.
+"""
+
+import hashlib
+import json
+import os
+import re
+from collections import Counter
+
+from dataset import read_dataset_chunks
+
+# same tokens as WordCloud.generate
+TOKEN_PATTERN = re.compile(r"\w[\w']+")
+
+
+def count_words(chunks, stop_words, text_column="reviews", label_column="sentiment"):
+    counts = {"all": Counter()}
+    for chunk in chunks:
+        for label, texts in chunk.groupby(label_column)[text_column]:
+            words = Counter(TOKEN_PATTERN.findall(" ".join(texts.dropna()).lower()))
+            counts.setdefault(str(label), Counter()).update(words)
+            counts["all"].update(words)
+
+    # filtering once per distinct word is cheaper than once per token
+    for counter in counts.values():
+        for word in stop_words & counter.keys():
+            del counter[word]
+    return counts
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def source_signature(path):
+    # the directory's own mtime misses files rewritten in place
+    if not os.path.isdir(path):
+        return {"path": str(path), **file_signature(path)}
+    with open(os.path.join(path, "manifest.json"), "rb") as f:
+        manifest = hashlib.sha256(f.read()).hexdigest()
+    return {
+        "path": str(path),
+        "manifest": manifest,
+        "files": {
+            name: file_signature(os.path.join(path, name))
+            for name in sorted(os.listdir(path))
+            if name != "manifest.json"
+        },
+    }
+
+
+def word_frequencies(path, stop_words, cache_path, chunksize=50_000):
+    source = source_signature(path)
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached["source"] == source:
+            return cached["frequencies"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    chunks = read_dataset_chunks(
+        path, columns=["reviews", "sentiment"], chunksize=chunksize
+    )
+    frequencies = count_words(chunks, {w.lower() for w in stop_words})
+    with open(cache_path, "w") as f:
+        json.dump({"source": source, "frequencies": frequencies}, f)
+    return frequencies